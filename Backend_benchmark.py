@@ -0,0 +1,65 @@
+import argparse
+import time
+
+import torch
+import whisper
+
+import metrics
+import transcriber
+from Dynamic_context_benchmark import load_clips, wer
+from model_loader import load_model
+
+# The TorchScript backend (exported.py) against eager PyTorch, on the same segments.
+#
+#   python exported.py base                     (one-time export, or let the first run do it)
+#   python Backend_benchmark.py clips/ --model base --batch-size 4
+#
+# Input as for Dynamic_context_benchmark.py: a directory of wav clips, one wav file cut with the
+# live silence logic, or nothing for synthetic clips. Prints the encoder and decoder seconds of
+# each backend and how far the exported text is from the eager one (it should be 0, the graphs
+# compute the same thing).
+
+
+def run(model, clips, language, batch_size, fp16):
+    encoder, decoder = metrics.registry.total("encoder"), metrics.registry.total("decoder")
+    texts = []
+    started = time.perf_counter()
+    for i in range(0, len(clips), batch_size):
+        texts += transcriber.transcribe_batch(model, [audio for audio, _ in clips[i:i + batch_size]], language, fp16)
+    elapsed = time.perf_counter() - started
+    return {"seconds": elapsed, "encoder": metrics.registry.total("encoder") - encoder,
+            "decoder": metrics.registry.total("decoder") - decoder, "texts": texts}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TorchScript backend against eager PyTorch")
+    parser.add_argument("input", nargs="?", help="directory of clips (+ .txt references) or one 16 kHz wav")
+    parser.add_argument("--model", default="tiny")
+    parser.add_argument("--device", default=None, help="cuda or cpu (default: cuda if available)")
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    device = args.device or ("cuda" if torch.cuda.is_available() else "cpu")
+    clips = load_clips(args.input)
+    audio_seconds = sum(len(audio) for audio, _ in clips) / whisper.audio.SAMPLE_RATE
+    print(f"model {args.model} on {device}, {len(clips)} clips, {audio_seconds:.1f} s of audio, "
+          f"batch size {args.batch_size}")
+    print(f"{'backend':>12} {'seconds':>8} {'rtf':>6} {'encoder':>8} {'decoder':>8} {'speedup':>8} {'wer':>6}")
+
+    results = {}
+    for backend in ("eager", "torchscript"):
+        model = load_model(args.model if backend == "eager" else f"{args.model}-jit", device=device)
+        transcriber.warm_up(model)
+        results[backend] = r = run(model, clips, args.language, args.batch_size, device == "cuda")
+        del model
+        speedup = results["eager"]["seconds"] / r["seconds"]
+        print(f"{backend:>12} {r['seconds']:>8.2f} {r['seconds'] / audio_seconds:>6.3f} {r['encoder']:>8.2f} "
+              f"{r['decoder']:>8.2f} {speedup:>7.2f}x {wer(results['eager']['texts'], r['texts']):>6.3f}")
+
+
+if __name__ == "__main__":
+    main()
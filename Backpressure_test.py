@@ -0,0 +1,123 @@
+import queue
+import threading
+import time
+
+import numpy as np
+
+from scheduler import LatencyScheduler
+from segmenter import END_OF_SOURCE, Segment
+
+# Overloads the scheduler with segments coming in faster than a (simulated) model can handle them
+# and checks that the latency stays bounded. The model is a sleep of a fixed time per segment,
+# like whisper, which pads every segment to 30 s.
+#
+#   python Backpressure_test.py
+
+RATE = 16000
+INTERVAL = 0.25     # a new 2 s segment every 0.25 s ...
+MAIN_COST = 0.5     # ... while the main model needs 0.5 s for each: 2x overloaded
+FALLBACK_COST = 0.1
+BUDGET = 1.5
+
+
+class FakeLoader:
+    def __init__(self, cost):
+        self.model = cost
+        self.error = None
+        self.ready = threading.Event()
+        self.ready.set()
+
+    def get(self):
+        return self.model
+
+
+def produce(audio_queue, count, interval=INTERVAL):
+    for i in range(count):
+        time.sleep(interval)
+        segment = Segment(np.zeros(2 * RATE, dtype=np.float32), RATE, i * interval, 10, time.time())
+        segment.queued_at = time.time()
+        audio_queue.put(segment)
+
+
+def transcribe(model_cost, batch):
+    started = time.time()
+    time.sleep(model_cost * len(batch))
+    for segment in batch:
+        segment.dequeued_at = started
+        segment.done_at = time.time()
+        segment.model_time = model_cost
+
+
+def run(scheduler, count, batch_size=1):
+    # returns the speech-to-text latency of every segment that made it through
+    audio_queue = queue.Queue()
+    threading.Thread(target=produce, args=(audio_queue, count), daemon=True).start()
+    latencies = []
+    while len(latencies) + scheduler.counters["dropped"] + scheduler.counters["coalesced"] < count:
+        model_cost, batch = scheduler.take(audio_queue, batch_size)
+        transcribe(model_cost, batch)
+        scheduler.done(batch)
+        latencies.extend(segment.done_at - segment.speech_end_at for segment in batch)
+    return latencies
+
+
+def test_keep_grows_without_bound():
+    # the baseline: without shedding the captions fall further and further behind
+    scheduler = LatencyScheduler(FakeLoader(MAIN_COST), budget=BUDGET, policy="keep")
+    latencies = run(scheduler, 16)
+    assert len(latencies) == 16
+    assert latencies[-1] > 2 * BUDGET, latencies[-1]
+
+
+def test_drop_keeps_latency_bounded():
+    scheduler = LatencyScheduler(FakeLoader(MAIN_COST), budget=BUDGET, policy="drop")
+    latencies = run(scheduler, 16)
+    assert scheduler.counters["dropped"] > 0
+    assert max(latencies[2:]) < BUDGET + MAIN_COST, max(latencies[2:])
+
+
+def test_coalesce_keeps_latency_bounded():
+    scheduler = LatencyScheduler(FakeLoader(MAIN_COST), budget=BUDGET, policy="coalesce")
+    latencies = run(scheduler, 16)
+    assert scheduler.counters["coalesced"] > 0
+    assert max(latencies[2:]) < BUDGET + MAIN_COST, max(latencies[2:])
+    # merging loses less audio than dropping
+    assert scheduler.counters["dropped_seconds"] < 16 * 2.0 / 2
+
+
+def test_fallback_model_and_back():
+    scheduler = LatencyScheduler(FakeLoader(MAIN_COST), FakeLoader(FALLBACK_COST), budget=BUDGET,
+                                 policy="keep", recover_time=0.5)
+    latencies = run(scheduler, 16)
+    assert scheduler.counters["downgrades"] == 1
+    assert scheduler.current == "fallback"
+
+    # once it has been quiet for recover_time, the next segment goes to the main model again
+    time.sleep(1.0)
+    run(scheduler, 1)
+    assert scheduler.counters["upgrades"] == 1
+    assert scheduler.current == "main"
+    assert scheduler.counters["dropped"] == 0
+    assert max(latencies[2:]) < BUDGET + MAIN_COST, max(latencies[2:])
+
+
+def test_end_of_source():
+    # a file that ended: everything queued before END_OF_SOURCE still comes out, then empty batches
+    scheduler = LatencyScheduler(FakeLoader(MAIN_COST), budget=BUDGET, policy="keep")
+    audio_queue = queue.Queue()
+    produce(audio_queue, 5, interval=0)
+    audio_queue.put(END_OF_SOURCE)
+    taken = []
+    while not (scheduler.ended and not scheduler.backlog):
+        _, batch = scheduler.take(audio_queue, 2)
+        taken.extend(batch)
+    assert len(taken) == 5
+    assert scheduler.take(audio_queue, 2)[1] == []     # does not block
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            started = time.time()
+            test()
+            print(f"{name}: ok ({time.time() - started:.1f} s)")
@@ -0,0 +1,248 @@
+import argparse
+import json
+import os
+import threading
+import time
+import wave
+
+import numpy as np
+
+from resampler import resample
+from segmenter import Segmenter
+from vad import make_vad
+from worker_pool import TranscriptionPool
+
+# Offline mode: transcribe recorded sessions instead of the microphone.
+#
+#   python Batch_transcribe.py recordings/ extra.wav --output-dir transcripts --workers 4 --model base
+#
+# Files are cut with the same silence logic as record_audio, the segments go through the
+# worker pool, and every file gets a <name>.jsonl (one line per segment) and <name>.srt.
+# Finished files are listed in <output-dir>/manifest.jsonl and skipped when the run is
+# started again, so an interrupted backfill just picks up where it stopped.
+
+WHISPER_RATE = 16000
+CHUNK = 1024
+AUDIO_EXTENSIONS = {".wav", ".mp3", ".flac", ".m4a", ".ogg", ".opus", ".webm", ".mp4", ".aac"}
+
+
+def find_audio_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in sorted(names)
+                             if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS)
+        else:
+            files.append(path)
+    return [os.path.abspath(f) for f in files]
+
+
+def load_audio(path):
+    # 16 kHz float32; plain 16-bit wav is read directly, everything else goes through ffmpeg
+    if path.lower().endswith(".wav"):
+        with wave.open(path, "rb") as wf:
+            if wf.getsampwidth() == 2:
+                audio = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16).astype(np.float32) / 32768.0
+                if wf.getnchannels() > 1:
+                    audio = audio.reshape(-1, wf.getnchannels()).mean(axis=1)
+                return resample(audio, wf.getframerate(), WHISPER_RATE)
+    import whisper
+    return whisper.load_audio(path)
+
+
+def file_key(path):
+    stat = os.stat(path)
+    return {"file": path, "size": stat.st_size, "mtime": int(stat.st_mtime)}
+
+
+def load_manifest(path):
+    done = set()
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    done.add((entry["file"], entry["size"], entry["mtime"]))
+    return done
+
+
+def srt_time(seconds):
+    ms = int(round(seconds * 1000))
+    return f"{ms // 3600000:02}:{ms // 60000 % 60:02}:{ms // 1000 % 60:02},{ms % 1000:03}"
+
+
+class FileJob:
+    def __init__(self, path, output_base, formats):
+        self.key = file_key(path)
+        self.path = path
+        self.output_base = output_base
+        self.formats = formats
+        self.audio_seconds = 0.0
+        self.segments = {}          # seq -> (start, end)
+        self.entries = []
+        self.pending = 0
+        self.submitted_all = False
+        os.makedirs(os.path.dirname(output_base), exist_ok=True)
+        self.jsonl = open(output_base + ".jsonl.part", "w", encoding="utf-8") if "jsonl" in formats else None
+
+    def add_result(self, seq, text, error):
+        start, end = self.segments.pop(seq)
+        entry = {"start": round(start, 3), "end": round(end, 3), "text": text if error is None else ""}
+        if error is not None:
+            entry["error"] = error
+        self.entries.append(entry)
+        if self.jsonl is not None:
+            self.jsonl.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.jsonl.flush()
+        self.pending -= 1
+
+    def finish(self):
+        if self.jsonl is not None:
+            self.jsonl.close()
+            os.replace(self.output_base + ".jsonl.part", self.output_base + ".jsonl")
+        if "srt" in self.formats:
+            with open(self.output_base + ".srt.part", "w", encoding="utf-8") as f:
+                for i, entry in enumerate(e for e in self.entries if e["text"]):
+                    f.write(f"{i + 1}\n{srt_time(entry['start'])} --> {srt_time(entry['end'])}\n{entry['text']}\n\n")
+            os.replace(self.output_base + ".srt.part", self.output_base + ".srt")
+
+
+class BatchRun:
+    def __init__(self, pool, output_dir, formats):
+        self.pool = pool
+        self.output_dir = output_dir
+        self.formats = formats
+        self.manifest_path = os.path.join(output_dir, "manifest.jsonl")
+        self.lock = threading.Lock()
+        self.jobs = {}              # seq -> FileJob
+        self.submitted = 0
+        self.written = 0
+        self.all_written = threading.Event()
+        self.audio_seconds = 0.0
+        self.files_done = 0
+        self.started = time.time()
+
+    def output_base(self, path, root):
+        relative = os.path.relpath(path, root) if root else os.path.basename(path)
+        return os.path.join(self.output_dir, os.path.splitext(relative)[0])
+
+    def finish_job(self, job):
+        # called with self.lock held
+        job.finish()
+        entry = dict(job.key, segments=len(job.entries), audio_seconds=round(job.audio_seconds, 3))
+        with open(self.manifest_path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        self.audio_seconds += job.audio_seconds
+        self.files_done += 1
+        elapsed = time.time() - self.started
+        print(f"[{self.files_done}] {job.path}: {len(job.entries)} segments, "
+              f"{self.audio_seconds / max(elapsed, 1e-9):.1f} audio-hours per hour so far")
+
+    def write_results(self):
+        # writer thread: results come back in submission order
+        for seq, text, error in self.pool.results_in_order():
+            with self.lock:
+                job = self.jobs.pop(seq)
+                job.add_result(seq, text, error)
+                if job.submitted_all and job.pending == 0:
+                    self.finish_job(job)
+                self.written += 1
+                if self.written == self.submitted:
+                    self.all_written.set()
+
+    def run(self, files, root_for, language, vad_backend, threshold, silence_time, min_speech_time, pre_roll=0.3,
+            post_roll=0.3):
+        threading.Thread(target=self.write_results, daemon=True).start()
+        for path in files:
+            try:
+                audio = load_audio(path)
+            except Exception as e:
+                print(f"Error decoding {path}: {e}")
+                continue
+            job = FileJob(path, self.output_base(path, root_for(path)), self.formats)
+            job.audio_seconds = len(audio) / WHISPER_RATE
+
+            vad = make_vad(vad_backend, WHISPER_RATE, CHUNK, threshold)
+            segmenter = Segmenter(vad, WHISPER_RATE, CHUNK, silence_time=silence_time, min_speech_time=min_speech_time,
+                                  pre_roll=pre_roll, post_roll=post_roll,
+                                  convert=lambda a: a.astype(np.float32) / 32768.0)
+            segments = segmenter.push_many((np.clip(audio, -1, 1) * 32767).astype(np.int16))
+            last = segmenter.flush()
+            if last is not None:
+                segments.append(last)
+
+            for segment in segments:
+                with self.lock:
+                    seq = self.pool.next_seq
+                    self.jobs[seq] = job
+                    job.segments[seq] = (segment.start, segment.end)
+                    job.pending += 1
+                    self.submitted += 1
+                    self.all_written.clear()
+                self.pool.submit(segment.audio, language, stream=path)   # each file detects its own language
+            with self.lock:
+                job.submitted_all = True
+                if job.pending == 0:
+                    self.finish_job(job)
+
+        with self.lock:
+            if self.written == self.submitted:
+                self.all_written.set()
+        self.all_written.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcribe audio files or directories of recordings")
+    parser.add_argument("inputs", nargs="+", help="audio files or directories")
+    parser.add_argument("--output-dir", default="transcripts")
+    parser.add_argument("--format", default="jsonl,srt", help="jsonl, srt or both")
+    parser.add_argument("--model", default="base")
+    parser.add_argument("--language", default="auto")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=None, help="threads per worker (default: cores / workers)")
+    parser.add_argument("--vad", default="adaptive", help="threshold or adaptive")
+    parser.add_argument("--threshold", type=float, default=None, help="needed with --vad threshold")
+    parser.add_argument("--silence", type=float, default=0.8, help="seconds of silence that close a segment")
+    parser.add_argument("--min-speech", type=float, default=0.2)
+    parser.add_argument("--pre-roll", type=float, default=0.3, help="seconds kept before the first speech chunk")
+    parser.add_argument("--post-roll", type=float, default=0.3, help="seconds kept after the last speech chunk")
+    args = parser.parse_args()
+    if args.vad == "threshold" and args.threshold is None:
+        parser.error("--vad threshold needs --threshold")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    done = load_manifest(os.path.join(args.output_dir, "manifest.jsonl"))
+    roots = [os.path.abspath(p) for p in args.inputs if os.path.isdir(p)]
+    files = []
+    for path in find_audio_files(args.inputs):
+        key = file_key(path)
+        if (key["file"], key["size"], key["mtime"]) in done:
+            continue
+        files.append(path)
+    print(f"{len(files)} files to transcribe ({len(done)} already done)")
+    if not files:
+        return
+
+    def root_for(path):
+        return next((r for r in roots if path.startswith(r + os.sep)), None)
+
+    started = time.time()
+    pool = TranscriptionPool(args.workers, args.model, threads_per_worker=args.threads)
+    try:
+        pool.wait_ready()
+        run = BatchRun(pool, args.output_dir, args.format.split(","))
+        run.started = time.time()
+        run.run(files, root_for, args.language, args.vad, args.threshold, args.silence, args.min_speech,
+                args.pre_roll, args.post_roll)
+    finally:
+        pool.close()
+
+    elapsed = time.time() - run.started
+    print(f"{run.files_done} files, {run.audio_seconds / 3600:.2f} audio hours in {elapsed / 3600:.2f} hours "
+          f"({run.audio_seconds / max(elapsed, 1e-9):.1f} audio-hours per wall-clock hour, "
+          f"{time.time() - started:.0f} s including model load)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+import wave
+
+import numpy as np
+
+from audio_source import ProcessSource, SharedRing, capture_microphone, make_source
+from Coalesce_benchmark import choppy_conversation
+from segmenter import Segmenter
+from vad import make_vad
+
+# Records a wav file in real time through the capture process (ProcessSource) while this
+# process runs the model flat out, and checks that every sample arrives, in order.
+#
+#   python Capture_stress_test.py
+
+RATE = 16000
+CHUNK = 1024
+SECONDS = 20        # of audio recorded under load
+MODEL = "tiny"
+
+
+def write_wav(path, audio):
+    wf = wave.open(path, "wb")
+    wf.setnchannels(1)
+    wf.setsampwidth(2)
+    wf.setframerate(RATE)
+    wf.writeframes(audio.tobytes())
+    wf.close()
+
+
+def full_load(stop):
+    # the model on every core, and a thread that keeps the GIL busy between its calls
+    import transcriber
+    from model_loader import load_model
+
+    model = load_model(MODEL, "cpu")
+    segments = [0.1 * np.random.default_rng(i).standard_normal(5 * RATE).astype(np.float32) for i in range(4)]
+    batches = [0]
+
+    def model_thread():
+        while not stop.is_set():
+            transcriber.transcribe_batch(model, segments, "en")
+            batches[0] += 1
+
+    def python_thread():
+        while not stop.is_set():
+            sum(i * i for i in range(10000))
+
+    threads = [threading.Thread(target=model_thread, daemon=True), threading.Thread(target=python_thread, daemon=True)]
+    for thread in threads:
+        thread.start()
+    return threads, batches
+
+
+def test_ring_read_write():
+    ring = SharedRing(1000)
+    try:
+        ring.write(np.arange(600, dtype=np.int16))
+        assert np.array_equal(ring.read(400), np.arange(400))
+        ring.write(np.arange(600, 1200, dtype=np.int16))    # wraps around
+        assert np.array_equal(ring.read(1000), np.arange(400, 1200))
+        assert ring.read(10).size == 0
+        assert ring.header[SharedRing.DROPPED] == 0
+    finally:
+        ring.close(unlink=True)
+
+
+def test_ring_counts_what_the_reader_missed():
+    ring = SharedRing(1000)
+    try:
+        ring.write(np.arange(1500, dtype=np.int16))
+        ring.write(np.arange(1500, 2500, dtype=np.int16))
+        assert np.array_equal(ring.read(100), np.arange(1500, 1600))
+        assert ring.header[SharedRing.DROPPED] == 1500
+    finally:
+        ring.close(unlink=True)
+
+
+class FakeStream:
+    # plays `chunks` through the stream callback from a thread of its own, like PortAudio does,
+    # with the given status flags on each call
+    def __init__(self, callback, chunks, statuses):
+        self.callback = callback
+        self.chunks = chunks
+        self.statuses = statuses
+        self.thread = threading.Thread(target=self.run)
+
+    def run(self):
+        for chunk, status in zip(self.chunks, self.statuses):
+            self.callback(chunk.tobytes(), len(chunk), {}, status)
+            time.sleep(0.001)
+
+    def start_stream(self):
+        self.thread.start()
+
+    def is_active(self):
+        return self.thread.is_alive()
+
+    def stop_stream(self):
+        self.thread.join()
+
+    def close(self):
+        pass
+
+
+def fake_pyaudio(chunks, statuses):
+    module = types.SimpleNamespace(paInt16=8, paInputOverflow=2, paContinue=0)
+
+    class PyAudio:
+        def open(self, stream_callback=None, **kwargs):
+            return FakeStream(stream_callback, chunks, statuses)
+
+        def terminate(self):
+            pass
+
+    module.PyAudio = PyAudio
+    return module
+
+
+def test_microphone_callback():
+    chunks = [np.full(CHUNK, i, dtype=np.int16) for i in range(20)]
+    statuses = [2 if i in (5, 12) else 0 for i in range(20)]   # PortAudio lost input twice
+    ring = SharedRing(CHUNK * 50)
+    saved = sys.modules.get("pyaudio")
+    sys.modules["pyaudio"] = fake_pyaudio(chunks, statuses)
+    try:
+        capture_microphone(ring, RATE, CHUNK)
+        assert np.array_equal(ring.read(CHUNK * 20), np.concatenate(chunks))
+        assert ring.header[SharedRing.OVERFLOWS] == 2
+        assert ring.header[SharedRing.DROPPED] == 0
+    finally:
+        if saved is None:
+            del sys.modules["pyaudio"]
+        else:
+            sys.modules["pyaudio"] = saved
+        ring.close(unlink=True)
+
+
+def test_fast_replay_waits_for_the_reader():
+    # @max replays as fast as the file can be read, the capture process has to wait for the
+    # reader instead of lapping the ring
+    audio = (np.clip(choppy_conversation(60), -1, 1) * 32767).astype(np.int16)
+    path = os.path.join(tempfile.mkdtemp(), "replay.wav")
+    write_wav(path, audio)
+    source = make_source(f"file:{path}@max", RATE, CHUNK, process=True)
+    received = []
+    try:
+        while True:
+            chunk = source.read(CHUNK)
+            if chunk is None:
+                break
+            received.append(chunk)
+            time.sleep(0.0005)  # a reader slower than the file
+    finally:
+        source.close()
+    assert source.dropped == 0, source.dropped
+    assert np.array_equal(np.concatenate(received), audio)
+
+
+def test_no_lost_samples_under_load():
+    audio = (np.clip(choppy_conversation(SECONDS), -1, 1) * 32767).astype(np.int16)
+    path = os.path.join(tempfile.mkdtemp(), "capture.wav")
+    write_wav(path, audio)
+
+    stop = threading.Event()
+    threads, batches = full_load(stop)
+    while batches[0] == 0:
+        time.sleep(0.1)     # the model is loaded and busy before recording starts
+
+    # what record_audio does with every chunk, in the loaded process
+    source = ProcessSource(f"file:{path}", RATE, CHUNK)
+    segmenter = Segmenter(make_vad("adaptive", RATE, CHUNK), RATE, CHUNK, silence_time=0.8, min_speech_time=0.2,
+                          pre_roll=0.3, post_roll=0.3, mel=True,
+                          convert=lambda chunk: chunk.astype(np.float32) / 32768.0)
+    received = []
+    backlog = 0
+    try:
+        while True:
+            backlog = max(backlog, source.ring.available())
+            chunk = source.read(CHUNK)
+            if chunk is None:
+                break
+            received.append(chunk)
+            segmenter.push(chunk)
+    finally:
+        stop.set()
+        source.close()
+    for thread in threads:
+        thread.join()
+
+    received = np.concatenate(received)
+    assert batches[0] > 1, "the model did not run during the recording"
+    assert source.overflows == 0 and source.dropped == 0, (source.overflows, source.dropped)
+    assert len(received) == len(audio), (len(received), len(audio))
+    assert np.array_equal(received, audio)
+    assert backlog < source.ring.capacity, backlog
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            started = time.time()
+            test()
+            print(f"{name}: ok ({time.time() - started:.1f} s)")
@@ -0,0 +1,106 @@
+import argparse
+import time
+
+import numpy as np
+import torch
+import whisper
+
+import metrics
+import transcriber
+from segmenter import Segmenter
+from Throughput_benchmark import load_wav, synthetic_speech
+from vad import make_vad
+
+# Encoder windows per minute of speech with the segment coalescer on and off, on CPU.
+#
+#   python Coalesce_benchmark.py conversation.wav --model base --window 24 --wait 3.0
+#
+# The recording is cut with the live silence logic and replayed in stream time, so segments
+# pile up while the model is busy, just like on the live queue. Without a file, a choppy
+# synthetic conversation is used (utterances of 0.5-2.5 s, pauses of 0.8-2 s).
+
+RATE = whisper.audio.SAMPLE_RATE
+CHUNK = 1024
+
+
+def choppy_conversation(seconds, seed=0):
+    rng = np.random.default_rng(seed)
+    parts, total = [], 0.0
+    while total < seconds:
+        speech = rng.uniform(0.5, 2.5)
+        pause = rng.uniform(0.8, 2.0)
+        parts.append(synthetic_speech(speech, seed=len(parts)))
+        parts.append(0.002 * rng.standard_normal(int(pause * RATE)).astype(np.float32))
+        total += speech + pause
+    return np.concatenate(parts)
+
+
+def cut(audio):
+    segmenter = Segmenter(make_vad("adaptive", RATE, CHUNK), RATE, CHUNK, silence_time=0.6, min_speech_time=0.2,
+                          convert=lambda a: a.astype(np.float32) / 32768.0)
+    segments = segmenter.push_many((np.clip(audio, -1, 1) * 32767).astype(np.int16))
+    last = segmenter.flush()
+    return segments + ([last] if last is not None else [])
+
+
+def run(model, segments, language, window, wait, max_segments, batch_size):
+    # Replays the segments in stream time: the model takes whatever has closed by the time it is
+    # free, waiting up to `wait` seconds after the first one (collect_batch), and the measured
+    # model time moves the clock on.
+    before = metrics.snapshot()["counters"].get("encoder_windows", 0)
+    clock, model_time, calls, position, texts = 0.0, 0.0, 0, 0, []
+    while position < len(segments):
+        clock = max(clock, segments[position].end)
+        deadline = max(clock, segments[position].end + wait)
+        group = [segments[position]]
+        position += 1
+        while position < len(segments) and len(group) < max_segments and segments[position].end <= deadline:
+            group.append(segments[position])
+            position += 1
+        started = time.perf_counter()
+        texts += transcriber.transcribe_segments(model, group, language, coalesce=window, batch_size=batch_size)
+        elapsed = time.perf_counter() - started
+        clock = max(clock, group[-1].end) + elapsed
+        model_time += elapsed
+        calls += 1
+    windows = metrics.snapshot()["counters"].get("encoder_windows", 0) - before
+    return windows, calls, model_time, texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encoder calls with and without the segment coalescer")
+    parser.add_argument("file", nargs="?", help="16 kHz mono 16-bit wav with conversation")
+    parser.add_argument("--model", default="tiny")
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--seconds", type=float, default=120, help="length of the synthetic conversation")
+    parser.add_argument("--window", type=float, default=24.0, help="seconds per packed window")
+    parser.add_argument("--wait", type=float, default=3.0, help="how long a segment may wait for others")
+    parser.add_argument("--batch-size", type=int, default=4)
+    args = parser.parse_args()
+
+    model = whisper.load_model(args.model, device="cpu")
+    audio = load_wav(args.file) if args.file else choppy_conversation(args.seconds)
+    segments = cut(audio)
+    speech_minutes = sum(s.duration for s in segments) / 60
+    print(f"model {args.model}, {len(segments)} segments, {speech_minutes:.1f} min of segmented audio, "
+          f"{torch.get_num_threads()} threads")
+
+    transcriber.transcribe_batch(model, [segments[0].audio], args.language)  # warm up
+    print(f"{'coalescer':>9} {'batches':>7} {'windows':>7} {'win/min':>8} {'model s':>8} {'with text':>9}")
+    results = {}
+    for window in (0, args.window):
+        if window:
+            windows, calls, model_time, texts = run(model, segments, args.language, window, args.wait,
+                                                    args.batch_size * 8, args.batch_size)
+        else:
+            windows, calls, model_time, texts = run(model, segments, args.language, 0, 0.0,
+                                                    args.batch_size, args.batch_size)
+        results[window] = texts
+        print(f"{'on' if window else 'off':>9} {calls:>7} {windows:>7} {windows / speech_minutes:>8.1f} "
+              f"{model_time:>8.2f} {sum(1 for t in texts if t):>9}")
+    changed = sum(1 for a, b in zip(results[0], results[args.window]) if a.strip() != b.strip())
+    print(f"{changed} of {len(segments)} segment texts differ between the two runs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import argparse
+import os
+import time
+
+import torch
+import whisper
+from whisper.normalizers import EnglishTextNormalizer
+
+import dynamic_encoder
+import transcriber
+from Coalesce_benchmark import cut
+from Throughput_benchmark import cut_segments, load_wav, synthetic_speech
+
+# Speed and word error rate of the reduced-context encoder against the full 30 s path, on CPU.
+#
+#   python Dynamic_context_benchmark.py clips/ --model base --buckets 2.5,5,10
+#   python Dynamic_context_benchmark.py session.wav --model base
+#
+# A directory holds one clip per wav file; a wav file next to it with the same name and .txt
+# is taken as the reference text. A single wav file is cut with the live silence logic. Without
+# references the WER is measured against what the full-context path wrote. Without input,
+# synthetic clips are used, good for timing only.
+
+
+def word_errors(reference, hypothesis):
+    # word level edit distance
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i] + [0] * len(hypothesis)
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_word != hyp_word))
+        previous = current
+    return previous[-1]
+
+
+def wer(references, hypotheses):
+    normalize = EnglishTextNormalizer()
+    errors = words = 0
+    for reference, hypothesis in zip(references, hypotheses):
+        ref_words = normalize(reference).split()
+        errors += word_errors(ref_words, normalize(hypothesis).split())
+        words += len(ref_words)
+    return errors / max(words, 1)
+
+
+def load_clips(path):
+    # (audio, reference or None) pairs
+    if path is None:
+        return [(audio, None) for audio in cut_segments(synthetic_speech(60), 24)]
+    if os.path.isdir(path):
+        clips = []
+        for name in sorted(os.listdir(path)):
+            if name.lower().endswith(".wav"):
+                text_path = os.path.join(path, name[:-4] + ".txt")
+                reference = open(text_path, encoding="utf-8").read().strip() if os.path.exists(text_path) else None
+                clips.append((load_wav(os.path.join(path, name)), reference))
+        return clips
+    return [(segment.audio, None) for segment in cut(load_wav(path))]
+
+
+def run(model, clips, language, dynamic, batch_size):
+    texts = []
+    started = time.perf_counter()
+    for i in range(0, len(clips), batch_size):
+        texts += transcriber.transcribe_batch(model, [audio for audio, _ in clips[i:i + batch_size]], language,
+                                              dynamic=dynamic)
+    return time.perf_counter() - started, texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reduced-context encoder against the full 30 s encoder")
+    parser.add_argument("input", nargs="?", help="directory of clips (+ .txt references) or one 16 kHz wav")
+    parser.add_argument("--model", default="tiny")
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--buckets", default="2.5,5,10", help="bucket sizes in seconds to try")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model = whisper.load_model(args.model, device="cpu")
+    clips = load_clips(args.input)
+    audio_seconds = sum(len(audio) for audio, _ in clips) / whisper.audio.SAMPLE_RATE
+    have_references = all(reference is not None for _, reference in clips)
+    transcriber.warm_up(model)
+
+    elapsed, full_texts = run(model, clips, args.language, False, args.batch_size)
+    references = [reference for _, reference in clips] if have_references else full_texts
+    print(f"model {args.model}, {len(clips)} clips, {audio_seconds:.1f} s of audio, {torch.get_num_threads()} threads, "
+          f"WER against {'the references' if have_references else 'the full-context text'}")
+    print(f"{'encoder':>13} {'seconds':>8} {'rtf':>6} {'speedup':>8} {'wer':>6}")
+    print(f"{'full 30 s':>13} {elapsed:>8.2f} {elapsed / audio_seconds:>6.3f} {1.0:>7.2f}x "
+          f"{wer(references, full_texts) if have_references else 0.0:>6.3f}")
+    baseline = elapsed
+    for bucket in [float(b) for b in args.buckets.split(",")]:
+        dynamic_encoder.BUCKET = bucket
+        elapsed, texts = run(model, clips, args.language, True, args.batch_size)
+        print(f"{f'{bucket:g} s buckets':>13} {elapsed:>8.2f} {elapsed / audio_seconds:>6.3f} "
+              f"{baseline / elapsed:>7.2f}x {wer(references, texts):>6.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import argparse
+import importlib
+import json
+import multiprocessing as mp
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+import numpy as np
+
+from segmenter import END_OF_SOURCE
+
+# Speech-end-to-text latency of the real pipeline: record_audio -> audio_queue -> process_audio_queue,
+# for both scripts and every model size, on CPU.
+#
+#   python Latency_benchmark.py --models tiny,base,small --output latency.json
+#   python Latency_benchmark.py talk.wav --baseline latency.json   # exits with 1 on a regression
+#
+# The audio is replayed through a file source at real time (--speed), so the segmenter and VAD see
+# it exactly as they would see the microphone. Without a wav file, synthetic utterances of 1-4 s
+# separated by pauses are used. Each script/model pair runs in a fresh process, so the memory
+# numbers are that model's alone.
+
+SCRIPTS = {"gpu": "Whisper_RT_GPU", "cpu": "Whisper_RT_CPU_Only"}
+RATE = 16000
+RESULT_TIMEOUT = 120.0  # seconds without a new result before the missing segments are given up on
+
+
+def synthetic_session(utterances, seed=0):
+    from Throughput_benchmark import synthetic_speech
+    rng = np.random.default_rng(seed)
+    parts = [0.002 * rng.standard_normal(RATE).astype(np.float32)]
+    for i in range(utterances):
+        parts.append(synthetic_speech(rng.uniform(1.0, 4.0), seed=seed + i))
+        parts.append(0.002 * rng.standard_normal(int(rng.uniform(1.5, 2.5) * RATE)).astype(np.float32))
+    return np.concatenate(parts)
+
+
+def write_wav(path, audio):
+    with wave.open(path, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(RATE)
+        wf.writeframes((np.clip(audio, -1, 1) * 32767).astype(np.int16).tobytes())
+
+
+def rss_peak_mb():
+    # (current, peak) resident set size, None where the platform doesn't tell
+    current = peak = None
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    current = int(line.split()[1]) / 1024
+                elif line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) / 1024
+    except OSError:
+        try:
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+        except ImportError:
+            pass
+    return current, peak
+
+
+def rss_pss_mb():
+    # (current resident set size, proportional set size: shared pages split between the processes
+    # that map them), None where the platform doesn't tell
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            fields = {line.split(":")[0]: int(line.split()[1]) for line in f if line.split()[-1] == "kB"}
+        return fields["Rss"] / 1024, fields["Pss"] / 1024
+    except (OSError, KeyError):
+        return None, None
+
+
+class CountingQueue(queue.Queue):
+    def __init__(self):
+        super().__init__()
+        self.segments = 0
+
+    def put(self, item, block=True, timeout=None):
+        if item is not None and item is not END_OF_SOURCE:
+            self.segments += 1
+        super().put(item, block, timeout)
+
+
+def percentiles(values):
+    if not values:
+        return None
+    return {"p50": float(np.percentile(values, 50)), "p95": float(np.percentile(values, 95)),
+            "max": float(np.max(values)), "mean": float(np.mean(values))}
+
+
+def run_case(script, model_name, wav_path, speed, language):
+    import torch
+    import metrics
+    from model_loader import BackgroundModel
+
+    app = importlib.import_module(SCRIPTS[script])
+    app.AUDIO_SOURCE = f"file:{wav_path}@{speed}x" if speed > 0 else f"file:{wav_path}@max"
+    app.STREAMING = False
+    app.CAPTURE_PROCESS = False  # a pool worker can't start processes of its own, and the file source doesn't need one
+    app.WHISPER_MODEL = model_name
+
+    loader = BackgroundModel(model_name, device="cpu")
+    loader.get()
+    load_time = loader.load_time
+
+    audio_queue = CountingQueue()
+    segments = []
+    lock = threading.Lock()
+
+    def on_result(segment, text):
+        with lock:
+            segments.append((segment, text))
+
+    cpu_started = time.process_time()
+    started = time.time()
+    record = threading.Thread(target=app.record_audio, args=(None, audio_queue, None, app.open_source()), daemon=True)
+    threading.Thread(target=app.process_audio_queue, args=(audio_queue, language, loader, on_result), daemon=True).start()
+    record.start()
+    record.join()
+    # a segment that fails in process_audio_queue never reaches on_result, it is counted as missing
+    done, progress_at = 0, time.time()
+    while done < audio_queue.segments and time.time() - progress_at < RESULT_TIMEOUT:
+        time.sleep(0.01)
+        with lock:
+            if len(segments) > done:
+                done, progress_at = len(segments), time.time()
+    wall = time.time() - started
+    cpu = time.process_time() - cpu_started
+    rss, peak_rss = rss_peak_mb()
+
+    latency = [s.done_at - s.speech_end_at for s, _ in segments]
+    return {
+        "script": script,
+        "model": model_name,
+        "threads": torch.get_num_threads(),
+        "segments": len(segments),
+        "missing": audio_queue.segments - len(segments),
+        "errors": metrics.registry.counters.get("errors", 0),
+        "empty": sum(1 for _, text in segments if not text),
+        "audio_seconds": sum(s.duration for s, _ in segments),
+        "load_seconds": load_time,
+        "latency": percentiles(latency),
+        "queue_wait": percentiles([s.dequeued_at - s.queued_at for s, _ in segments]),
+        "model_time": percentiles([s.model_time for s, _ in segments]),
+        "rtf": percentiles([s.model_time / s.duration for s, _ in segments]),
+        "cpu_percent": 100.0 * cpu / wall,
+        "rss_mb": rss,
+        "peak_rss_mb": peak_rss,
+    }
+
+
+def compare(results, baseline, tolerance):
+    # a case regresses when its p95 latency or p50 rtf is more than `tolerance` worse than the baseline
+    previous = {(r["script"], r["model"]): r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        old = previous.get((r["script"], r["model"]))
+        if old is None or not r["latency"] or not old["latency"]:
+            continue
+        for metric, stat in (("latency", "p95"), ("rtf", "p50")):
+            before, after = old[metric][stat], r[metric][stat]
+            if after > before * (1 + tolerance):
+                regressions.append(f"{r['script']}/{r['model']} {metric} {stat}: {before:.3f} -> {after:.3f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end latency and real-time factor benchmark on CPU")
+    parser.add_argument("file", nargs="?", help="16 kHz mono 16-bit wav with speech and pauses")
+    parser.add_argument("--models", default="tiny,base,small")
+    parser.add_argument("--scripts", default="gpu,cpu")
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--utterances", type=int, default=12, help="synthetic utterances, without a wav file")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed, 1 = real time, 0 = as fast as possible")
+    parser.add_argument("--output", help="write the results to this json file")
+    parser.add_argument("--baseline", help="json file of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.file:
+            wav_path = os.path.abspath(args.file)
+        else:
+            wav_path = os.path.join(tmp, "session.wav")
+            write_wav(wav_path, synthetic_session(args.utterances))
+
+        results = []
+        context = mp.get_context("spawn")
+        print(f"{'script':>6} {'model':>6} {'segs':>5} {'lat p50':>8} {'lat p95':>8} {'wait p95':>9} "
+              f"{'model p50':>10} {'rtf p50':>8} {'cpu %':>6} {'rss MB':>7}")
+        for model_name in args.models.split(","):
+            for script in args.scripts.split(","):
+                with context.Pool(1) as pool:
+                    r = pool.apply(run_case, (script, model_name, wav_path, args.speed, args.language))
+                results.append(r)
+                if r["missing"]:
+                    print(f"{script:>6} {model_name:>6} {r['missing']} segments got no result ({r['errors']} errors)")
+                if not r["segments"]:
+                    print(f"{script:>6} {model_name:>6} {0:>5}  no segments found")
+                    continue
+                print(f"{script:>6} {model_name:>6} {r['segments']:>5} {r['latency']['p50']:>8.3f} "
+                      f"{r['latency']['p95']:>8.3f} {r['queue_wait']['p95']:>9.3f} {r['model_time']['p50']:>10.3f} "
+                      f"{r['rtf']['p50']:>8.3f} {r['cpu_percent']:>6.0f} {r['peak_rss_mb'] or 0:>7.0f}")
+
+    report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "input": args.file or f"synthetic:{args.utterances}",
+              "speed": args.speed, "cpu_count": os.cpu_count(), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line)
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import argparse
+import json
+import multiprocessing as mp
+import time
+
+# Load time and memory of 1..N transcription processes on one host, whisper.load_model against
+# the memory-mapped weight cache (weight_cache.py).
+#
+#   python Load_benchmark.py --model base --processes 1,2,4,8
+#
+# The processes of a round start together, each loads the model, runs the warm-up and waits
+# until all of them are done, so the memory is measured with all of them resident. RSS counts
+# the mapped weights in every process that touched them; PSS splits shared pages between the
+# processes, so the PSS of a round adds up to what it takes on the host. The cache is written
+# before the first round, the rounds run with the file in the page cache (the usual case after
+# the first start). Memory numbers need Linux.
+
+
+def run_process(loader, model_name, threads, started, barrier, results):
+    import torch
+    torch.set_num_threads(threads)
+    import whisper
+
+    import transcriber
+    import weight_cache
+    from Latency_benchmark import rss_pss_mb
+
+    imported = time.time()
+    if loader == "whisper":
+        model = whisper.load_model(model_name, device="cpu")
+    else:
+        model = weight_cache.load_model(model_name, device="cpu")
+    loaded = time.time()
+    transcriber.warm_up(model)
+    ready = time.time()
+    barrier.wait()
+    rss, pss = rss_pss_mb()
+    results.put({"import_seconds": imported - started, "load_seconds": loaded - imported,
+                 "ready_seconds": ready - started, "rss_mb": rss, "pss_mb": pss})
+    barrier.wait()      # nobody leaves before everyone has measured
+
+
+def run_round(context, loader, model_name, processes, threads):
+    barrier = context.Barrier(processes)
+    results = context.Queue()
+    started = time.time()
+    workers = [context.Process(target=run_process, args=(loader, model_name, threads, started, barrier, results))
+               for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    rows = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    return rows
+
+
+def prepare_cache(model_name):
+    import weight_cache
+    weight_cache.load_model(model_name, device="cpu")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Model load time and memory for 1..N processes")
+    parser.add_argument("--model", default="base")
+    parser.add_argument("--processes", default="1,2,4", help="comma separated process counts")
+    parser.add_argument("--loaders", default="whisper,cache", help="whisper and/or cache")
+    parser.add_argument("--threads", type=int, default=1, help="torch threads per process")
+    parser.add_argument("--output", default=None, help="write the numbers to this json file")
+    args = parser.parse_args()
+
+    context = mp.get_context("spawn")
+    with context.Pool(1) as pool:
+        started = time.time()
+        pool.apply(prepare_cache, (args.model,))
+        print(f"Weight cache ready in {time.time() - started:.1f} s")
+
+    report = []
+    print(f"{'loader':>8} {'procs':>5} {'load s':>7} {'ready s':>8} {'RSS MB':>7} {'PSS MB':>7} {'host MB':>8}")
+    for loader in args.loaders.split(","):
+        for processes in [int(n) for n in args.processes.split(",")]:
+            rows = run_round(context, loader, args.model, processes, args.threads)
+            load = max(row["load_seconds"] for row in rows)
+            ready = max(row["ready_seconds"] for row in rows)
+            rss = sum(row["rss_mb"] or 0 for row in rows) / processes
+            pss = sum(row["pss_mb"] or 0 for row in rows) / processes
+            print(f"{loader:>8} {processes:>5} {load:>7.2f} {ready:>8.2f} {rss:>7.0f} {pss:>7.0f} {pss * processes:>8.0f}")
+            report.append({"loader": loader, "processes": processes, "rows": rows})
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
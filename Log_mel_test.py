@@ -0,0 +1,101 @@
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+import whisper
+
+import features
+import transcriber
+from Coalesce_benchmark import choppy_conversation
+from resampler import Resampler
+from segmenter import Segmenter
+from vad import make_vad
+
+# Checks that the log-mel features computed during capture (features.py) are the ones
+# whisper.log_mel_spectrogram computes from the closed segment.
+#
+#   python Log_mel_test.py
+
+RATE = 16000
+CHUNK = 1024
+TOLERANCE = 1e-4    # log-mel units, whisper's output spans about 2
+
+
+def whisper_mel(audio, length=whisper.audio.N_SAMPLES):
+    return whisper.log_mel_spectrogram(whisper.pad_or_trim(audio, length)).numpy()
+
+
+def capture(audio, rate=RATE, max_segment_time=30.0):
+    # audio through the live Segmenter with mel=True, as record_audio does it
+    pcm = (np.clip(audio, -1, 1) * 32767).astype(np.int16)
+    resampler = Resampler(rate, RATE) if rate != RATE else None
+
+    def convert(chunk):
+        chunk = chunk.astype(np.float32) / 32768.0
+        return resampler.process(chunk) if resampler is not None else chunk
+
+    segmenter = Segmenter(make_vad("adaptive", rate, CHUNK), rate, CHUNK, silence_time=0.6, min_speech_time=0.2,
+                          pre_roll=0.3, post_roll=0.3, max_segment_time=max_segment_time, convert=convert,
+                          output_rate=RATE, mel=True)
+    segments = segmenter.push_many(pcm)
+    last = segmenter.flush()
+    return segments + ([last] if last is not None else [])
+
+
+def test_matches_whisper_without_capture_frames():
+    rng = np.random.default_rng(0)
+    for samples in (300, 1000, 2 * RATE + 37, 29 * RATE + 150, 30 * RATE, 31 * RATE):
+        audio = (0.1 * rng.standard_normal(samples)).astype(np.float32)
+        assert np.abs(features.log_mel(audio) - whisper_mel(audio)).max() < TOLERANCE, samples
+
+
+def test_capture_frames_match_whisper():
+    segments = capture(choppy_conversation(120))
+    assert len(segments) > 10
+    for segment in segments:
+        assert segment.mel_frames is not None
+        assert np.abs(features.log_mel(segment.audio, segment.mel_frames) - whisper_mel(segment.audio)).max() < TOLERANCE
+
+
+def test_resampled_chunks():
+    # the CPU script records at 44.1 kHz, the resampler hands out chunks of varying length
+    audio = choppy_conversation(40)
+    audio = np.interp(np.arange(len(audio) * 44100 // RATE) * RATE / 44100, np.arange(len(audio)), audio)
+    segments = capture(audio.astype(np.float32), rate=44100)
+    assert segments
+    for segment in segments:
+        assert np.abs(features.log_mel(segment.audio, segment.mel_frames) - whisper_mel(segment.audio)).max() < TOLERANCE
+
+
+def test_ring_wraps():
+    # ten minutes through rings sized for 5 s segments
+    segments = capture(choppy_conversation(600), max_segment_time=5.0)
+    for segment in segments[-5:]:
+        assert segment.mel_frames is not None
+        assert np.abs(features.log_mel(segment.audio, segment.mel_frames) - whisper_mel(segment.audio)).max() < TOLERANCE
+
+
+def test_shorter_encoder_window():
+    # dynamic_encoder.py pads to 5 s buckets instead of 30 s
+    for segment in capture(choppy_conversation(30))[:5]:
+        length = 5 * RATE
+        got = features.log_mel(segment.audio, segment.mel_frames, length)
+        assert np.abs(got - whisper_mel(segment.audio, length)).max() < TOLERANCE
+
+
+def test_log_mel_batch_uses_capture_frames():
+    model = SimpleNamespace(dims=SimpleNamespace(n_mels=80), device=torch.device("cpu"))
+    segments = capture(choppy_conversation(30))[:4]
+    audio = [segment.audio for segment in segments]
+    with_frames = transcriber.log_mel_batch(model, audio, frames=[segment.mel_frames for segment in segments])
+    without = transcriber.log_mel_batch(model, audio)
+    assert torch.abs(with_frames - without).max().item() < TOLERANCE
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            started = time.time()
+            test()
+            print(f"{name}: ok ({time.time() - started:.1f} s)")
@@ -0,0 +1,74 @@
+import argparse
+import multiprocessing as mp
+
+# Real-time factor, memory and accuracy of the int8 backend against fp32, per model size, on CPU.
+#
+#   python Quantization_benchmark.py clips/ --models tiny,base,small --threads 4
+#
+# Input as for Dynamic_context_benchmark.py: a directory of wav clips with optional .txt
+# references, one wav file, or nothing for synthetic clips (timing only). Without references the
+# int8 text is scored against the fp32 text of the same size. Every model is loaded in a fresh
+# process, so the memory numbers are its own. Run it twice, the first run also quantizes and
+# caches the int8 models.
+
+
+def run_case(model_name, input_path, language, threads):
+    import time
+
+    import torch
+    torch.set_num_threads(threads)
+    import whisper
+
+    import transcriber
+    from Dynamic_context_benchmark import load_clips
+    from Latency_benchmark import rss_peak_mb
+    from model_loader import load_model
+
+    clips = load_clips(input_path)
+    before, _ = rss_peak_mb()
+    started = time.perf_counter()
+    model = load_model(model_name, device="cpu")
+    load_seconds = time.perf_counter() - started
+    transcriber.warm_up(model)
+    loaded, _ = rss_peak_mb()  # after a pass over all the weights, mapped ones are only read in when used
+
+    texts = []
+    started = time.perf_counter()
+    for audio, _ in clips:
+        texts += transcriber.transcribe_batch(model, [audio], language)
+    elapsed = time.perf_counter() - started
+    audio_seconds = sum(len(audio) for audio, _ in clips) / whisper.audio.SAMPLE_RATE
+    _, peak = rss_peak_mb()
+    return {"model": model_name, "load_seconds": load_seconds, "rtf": elapsed / audio_seconds,
+            "model_mb": loaded - before if loaded is not None else None, "peak_rss_mb": peak, "texts": texts}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fp32 against int8 dynamic quantization on CPU")
+    parser.add_argument("input", nargs="?", help="directory of clips (+ .txt references) or one 16 kHz wav")
+    parser.add_argument("--models", default="tiny,base,small")
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    from Dynamic_context_benchmark import load_clips, wer
+    references = [reference for _, reference in load_clips(args.input)]
+    have_references = all(reference is not None for reference in references)
+
+    print(f"WER against {'the references' if have_references else 'the fp32 text'}, {args.threads} threads")
+    print(f"{'model':>11} {'load s':>7} {'rtf':>6} {'model MB':>9} {'peak MB':>8} {'wer':>6}")
+    context = mp.get_context("spawn")
+    for size in args.models.split(","):
+        fp32_texts = None
+        for model_name in (size, f"{size}-int8"):
+            with context.Pool(1) as pool:
+                r = pool.apply(run_case, (model_name, args.input, args.language, args.threads))
+            if fp32_texts is None:
+                fp32_texts = r["texts"]
+            score = wer(references if have_references else fp32_texts, r["texts"])
+            print(f"{model_name:>11} {r['load_seconds']:>7.1f} {r['rtf']:>6.3f} {r['model_mb'] or 0:>9.0f} "
+                  f"{r['peak_rss_mb'] or 0:>8.0f} {score:>6.3f}")
+
+
+if __name__ == "__main__":
+    main()
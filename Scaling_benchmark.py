@@ -0,0 +1,61 @@
+import argparse
+import os
+import queue
+import time
+
+from segmenter import Segment
+from Throughput_benchmark import cut_segments, load_wav, synthetic_speech
+from worker_pool import TranscriptionPool
+
+# Throughput of the worker pool for 1 to N worker processes, each limited to cores / N threads.
+#
+#   python Scaling_benchmark.py speech.wav --model base --max-workers 8
+
+
+def run(workers, model_name, segments, language, threads):
+    pool = TranscriptionPool(workers, model_name, threads_per_worker=threads)
+    try:
+        load_time = pool.wait_ready()
+        audio_queue = queue.Queue()
+        for audio in segments:
+            audio_queue.put(Segment(audio, 16000, 0.0, 0))
+        started = time.perf_counter()
+        pool.feed(audio_queue, language)
+        for seq, text, error in pool.results_in_order():
+            if seq == len(segments) - 1:
+                break
+        elapsed = time.perf_counter() - started
+        return elapsed, load_time, [busy / elapsed for busy in pool.busy_time]
+    finally:
+        pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker pool scaling benchmark")
+    parser.add_argument("file", nargs="?", help="16 kHz mono 16-bit wav with speech")
+    parser.add_argument("--model", default="tiny")
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--segments", type=int, default=32)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads", type=int, default=None, help="threads per worker (default: cores / workers)")
+    args = parser.parse_args()
+
+    audio = load_wav(args.file) if args.file else synthetic_speech(60)
+    segments = cut_segments(audio, args.segments)
+    audio_seconds = sum(len(s) for s in segments) / 16000
+
+    print(f"model {args.model}, {len(segments)} segments, {audio_seconds:.1f} s of audio, {os.cpu_count()} cores")
+    print(f"{'workers':>7} {'threads':>7} {'ready s':>7} {'seconds':>8} {'seg/s':>7} {'rtf':>6} {'speedup':>7} {'util':>5}")
+    baseline = None
+    workers = 1
+    while workers <= args.max_workers:
+        threads = args.threads or max(1, (os.cpu_count() or 1) // workers)
+        elapsed, load_time, utilization = run(workers, args.model, segments, args.language, threads)
+        baseline = baseline or elapsed
+        print(f"{workers:>7} {threads:>7} {load_time:>7.1f} {elapsed:>8.2f} {len(segments) / elapsed:>7.2f} "
+              f"{elapsed / audio_seconds:>6.3f} {baseline / elapsed:>7.2f} {sum(utilization) / workers:>5.0%}")
+        workers *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import argparse
+import json
+import socket
+import threading
+import time
+import wave
+
+import numpy as np
+
+from Whisper_RT_Server import HEADER, frame
+
+# Load generator for Whisper_RT_Server.py: how the latency grows with the number of rooms.
+#
+#   python Whisper_RT_Server.py --model base &
+#   python Server_benchmark.py talk.wav --streams 1,2,4,8,16 --seconds 60
+#
+# Every stream plays the recording in real time over its own connection, each one starting at a
+# different point so the rooms don't talk in sync. Without a wav file, synthetic utterances are
+# used. "latency" is the server's speech end -> text time; "e2e" is from the moment the end of a
+# segment was sent until its text came back, so it also holds the silence that closed it.
+
+CHUNK_SECONDS = 0.1     # audio per frame, like a client that sends what the microphone gave it
+
+
+def load_pcm(path):
+    with wave.open(path, "rb") as wf:
+        if wf.getsampwidth() != 2 or wf.getnchannels() != 1:
+            raise ValueError(f"{path}: only 16-bit mono wav files are supported")
+        return np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16), wf.getframerate()
+
+
+def recv_exactly(sock, n):
+    data = b""
+    while len(data) < n:
+        part = sock.recv(n - len(data))
+        if not part:
+            raise ConnectionError("server closed the connection")
+        data += part
+    return data
+
+
+def run_stream(host, port, pcm, rate, seconds, language, results):
+    sock = socket.create_connection((host, port))
+    sock.sendall(frame(json.dumps({"rate": rate, "language": language}).encode("utf-8")))
+    step = int(CHUNK_SECONDS * rate)
+    total = int(seconds * rate)
+    started = time.perf_counter()
+
+    def receive():
+        while True:
+            (length,) = HEADER.unpack(recv_exactly(sock, HEADER.size))
+            message = json.loads(recv_exactly(sock, length))
+            if message.get("done"):
+                return
+            message["e2e"] = time.perf_counter() - started - message["end"]
+            results.append(message)
+
+    reader = threading.Thread(target=receive, daemon=True)
+    reader.start()
+    for sent in range(0, total, step):
+        due = started + sent / rate
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        sock.sendall(frame(np.take(pcm, range(sent, min(sent + step, total)), mode="wrap").tobytes()))
+    sock.sendall(frame(b""))
+    reader.join()
+    sock.close()
+
+
+def percentiles(values):
+    if not values:
+        return 0.0, 0.0, 0.0
+    return float(np.percentile(values, 50)), float(np.percentile(values, 95)), float(np.max(values))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent streams against Whisper_RT_Server.py")
+    parser.add_argument("input", nargs="?", help="16-bit mono wav (any rate), synthetic speech without it")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--streams", default="1,2,4,8")
+    parser.add_argument("--seconds", type=float, default=60.0, help="audio per stream")
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--output", default=None, help="write the numbers to this json file")
+    args = parser.parse_args()
+
+    if args.input:
+        pcm, rate = load_pcm(args.input)
+    else:
+        from Latency_benchmark import RATE, synthetic_session
+        pcm, rate = (np.clip(synthetic_session(20), -1, 1) * 32767).astype(np.int16), RATE
+
+    print(f"{args.seconds:.0f} s of audio per stream")
+    print(f"{'streams':>7} {'segments':>8} {'latency p50':>11} {'p95':>6} {'max':>6} {'e2e p50':>8} {'p95':>6}")
+    report = []
+    for n in [int(s) for s in args.streams.split(",")]:
+        results = []
+        threads = []
+        for i in range(n):
+            offset = len(pcm) * i // n
+            threads.append(threading.Thread(target=run_stream, args=(args.host, args.port, np.roll(pcm, -offset), rate,
+                                                                      args.seconds, args.language, results)))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        latency = percentiles([r["latency"] for r in results])
+        e2e = percentiles([r["e2e"] for r in results])
+        print(f"{n:>7} {len(results):>8} {latency[0]:>11.2f} {latency[1]:>6.2f} {latency[2]:>6.2f} "
+              f"{e2e[0]:>8.2f} {e2e[1]:>6.2f}")
+        report.append({"streams": n, "segments": len(results), "latency_p50": latency[0], "latency_p95": latency[1],
+                       "latency_max": latency[2], "e2e_p50": e2e[0], "e2e_p95": e2e[1]})
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
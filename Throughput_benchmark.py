@@ -0,0 +1,83 @@
+import argparse
+import time
+import wave
+
+import numpy as np
+import torch
+import whisper
+
+import transcriber
+
+# Segments/sec and real-time factor of transcriber.transcribe_batch against the batch size, on CPU.
+#
+#   python Throughput_benchmark.py speech.wav --model base --batch-sizes 1,2,4,8
+#
+# The wav file is cut into segments of 1-5 s (random lengths, same for every batch size).
+# Without a file, synthetic voiced audio is used, which is fine for timing but not for text.
+
+
+def load_wav(path):
+    with wave.open(path, "rb") as wf:
+        if wf.getsampwidth() != 2 or wf.getnchannels() != 1 or wf.getframerate() != whisper.audio.SAMPLE_RATE:
+            raise ValueError(f"{path}: expected 16 kHz mono 16-bit wav")
+        return np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def synthetic_speech(seconds, seed=0):
+    rng = np.random.default_rng(seed)
+    rate = whisper.audio.SAMPLE_RATE
+    t = np.arange(int(seconds * rate)) / rate
+    f0 = 120 + 30 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / rate
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 12))
+    envelope = np.clip(np.sin(2 * np.pi * 3 * t), 0, None)
+    return (0.1 * voiced * envelope + 0.005 * rng.standard_normal(len(t))).astype(np.float32)
+
+
+def cut_segments(audio, count, seed=0):
+    rng = np.random.default_rng(seed)
+    rate = whisper.audio.SAMPLE_RATE
+    segments, position = [], 0
+    for _ in range(count):
+        length = int(rng.uniform(1.0, 5.0) * rate)
+        if position + length > len(audio):
+            position = 0
+        segments.append(audio[position:position + length])
+        position += length
+    return segments
+
+
+def run(model, segments, batch_size, language):
+    started = time.perf_counter()
+    for i in range(0, len(segments), batch_size):
+        transcriber.transcribe_batch(model, segments[i:i + batch_size], language)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch size throughput benchmark on CPU")
+    parser.add_argument("file", nargs="?", help="16 kHz mono 16-bit wav with speech")
+    parser.add_argument("--model", default="tiny")
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--segments", type=int, default=16)
+    parser.add_argument("--batch-sizes", default="1,2,4,8")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model = whisper.load_model(args.model, device="cpu")
+    audio = load_wav(args.file) if args.file else synthetic_speech(60)
+    segments = cut_segments(audio, args.segments)
+    audio_seconds = sum(len(s) for s in segments) / whisper.audio.SAMPLE_RATE
+
+    run(model, segments[:1], 1, args.language)  # warm up
+    print(f"model {args.model}, {len(segments)} segments, {audio_seconds:.1f} s of audio, {torch.get_num_threads()} threads")
+    print(f"{'batch':>5} {'seconds':>8} {'seg/s':>7} {'rtf':>6}")
+    for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+        elapsed = run(model, segments, batch_size, args.language)
+        print(f"{batch_size:>5} {elapsed:>8.2f} {len(segments) / elapsed:>7.2f} {elapsed / audio_seconds:>6.3f}")
+
+
+if __name__ == "__main__":
+    main()
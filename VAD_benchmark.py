@@ -0,0 +1,108 @@
+import argparse
+import time
+import wave
+
+import numpy as np
+
+from segmenter import Segmenter
+from vad import make_vad
+
+# Replays recorded room noise (no speech in it) through the segmenter with each VAD backend.
+# Every segment that comes out is a false trigger that would have cost a full whisper pass.
+#
+#   python VAD_benchmark.py noise1.wav noise2.wav --model tiny
+#   python VAD_benchmark.py                     (synthetic noise that gets louder half way)
+
+
+def load_wav(path):
+    with wave.open(path, "rb") as wf:
+        if wf.getsampwidth() != 2:
+            raise ValueError(f"{path}: only 16-bit wav files are supported")
+        audio = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+        if wf.getnchannels() > 1:
+            audio = audio.reshape(-1, wf.getnchannels()).mean(axis=1).astype(np.int16)
+        return audio, wf.getframerate()
+
+
+def synthetic_noise(rate, seconds=120, seed=0):
+    # quiet room for the first half, then a fan comes on (+20 dB), with hum and keyboard clicks
+    rng = np.random.default_rng(seed)
+    n = int(rate * seconds)
+    noise = np.convolve(rng.standard_normal(n), np.ones(8) / 8, mode="same")  # a bit darker than white
+    noise /= noise.std()
+    level = np.where(np.arange(n) < n // 2, 0.003, 0.03)
+    t = np.arange(n) / rate
+    audio = noise * level + 0.002 * np.sin(2 * np.pi * 50 * t)
+    for click in rng.integers(0, n - 200, size=int(seconds)):
+        audio[click:click + 200] += rng.standard_normal(200) * 0.1 * np.exp(-np.arange(200) / 30)
+    return (np.clip(audio, -1, 1) * 32767).astype(np.int16)
+
+
+def replay(audio, rate, backend, threshold, chunk, silence_time, min_speech_time):
+    vad = make_vad(backend, rate, chunk, threshold)
+    segmenter = Segmenter(vad, rate, chunk, silence_time=silence_time, min_speech_time=min_speech_time)
+    started = time.perf_counter()
+    segments = segmenter.push_many(audio)
+    segment = segmenter.flush()
+    if segment is not None:
+        segments.append(segment)
+    return segments, time.perf_counter() - started
+
+
+def model_time(model, segments):
+    import whisper
+
+    total = 0.0
+    for segment in segments:
+        audio = segment.audio.astype(np.float32) / 32768.0
+        if segment.rate != whisper.audio.SAMPLE_RATE:
+            n_out = int(len(audio) * whisper.audio.SAMPLE_RATE / segment.rate)
+            audio = np.interp(np.arange(n_out) * segment.rate / whisper.audio.SAMPLE_RATE, np.arange(len(audio)), audio).astype(np.float32)
+        started = time.perf_counter()
+        model.transcribe(audio, fp16=False)
+        total += time.perf_counter() - started
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="False-trigger benchmark for the VAD backends")
+    parser.add_argument("files", nargs="*", help="16-bit wav recordings of room noise without speech")
+    parser.add_argument("--backends", default="threshold,adaptive")
+    parser.add_argument("--threshold", type=float, default=None,
+                        help="threshold for the threshold backend (default: twice the background of the first 5 seconds)")
+    parser.add_argument("--chunk", type=int, default=1024)
+    parser.add_argument("--silence", type=float, default=0.8)
+    parser.add_argument("--min-speech", type=float, default=0.2)
+    parser.add_argument("--model", default=None, help="whisper model to time the wasted passes with (tiny / base / ...)")
+    parser.add_argument("--rtf", type=float, default=0.3,
+                        help="real-time factor used to estimate model time when --model is not given")
+    args = parser.parse_args()
+
+    recordings = [load_wav(path) for path in args.files] or [(synthetic_noise(16000), 16000)]
+    model = None
+    if args.model:
+        import whisper
+        model = whisper.load_model(args.model, device="cpu")
+
+    print(f"{'backend':<10} {'noise min':>9} {'triggers':>8} {'per min':>8} {'audio s':>8} {'model s':>8} {'vad ms/h':>9}")
+    for backend in args.backends.split(","):
+        minutes = triggers = triggered = wasted = vad_time = 0.0
+        for audio, rate in recordings:
+            threshold = args.threshold
+            if threshold is None:
+                threshold = 2 * np.abs(audio[:rate * 5].astype(np.float32)).mean()
+            segments, elapsed = replay(audio, rate, backend, threshold, args.chunk, args.silence, args.min_speech)
+            minutes += len(audio) / rate / 60
+            triggers += len(segments)
+            seconds = sum(s.end - s.start for s in segments)
+            triggered += seconds
+            wasted += model_time(model, segments) if model is not None else seconds * args.rtf
+            vad_time += elapsed
+        print(f"{backend:<10} {minutes:>9.1f} {int(triggers):>8} {triggers / minutes:>8.2f} {triggered:>8.1f} "
+              f"{wasted:>8.1f} {vad_time * 1000 / (minutes / 60):>9.0f}")
+    if model is None:
+        print(f"(model time estimated with rtf {args.rtf}, pass --model to measure it)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,56 @@
+import time
+LAUNCHED = time.time()  # for the time-to-ready report
+
 import pyaudio
 import wave
 import numpy as np
-import whisper
-import time
 import queue
 import threading
 import os
+import metrics
+import streaming
+from audio_source import make_source
+from language import LanguageController
+from model_loader import BackgroundModel
+from resampler import Resampler
+from scheduler import LatencyScheduler
+from segmenter import END_OF_SOURCE, Segment, Segmenter
+from speech_gate import NoSpeechGate
+from worker_pool import TranscriptionPool
+from vad import make_vad
 
 CHUNK = 1024
 FORMAT = pyaudio.paInt16
 CHANNELS = 1
-RATE = 44100
+RATE = 44100  # any rate the microphone supports, it is resampled to 16 kHz while recording
+WHISPER_RATE = 16000  # whisper expects 16 kHz audio
+AUDIO_SOURCE = "mic"  # mic / file:<path>[@<N>x|@max][@loop] / stdin / tcp:<host>:<port>, see audio_source.py
+CAPTURE_PROCESS = True  # record in a separate process, so a busy model can't make the microphone lose audio
+ARCHIVE_AUDIO = False  # also write every segment to a wav file (done on a separate thread)
+STREAMING = False  # show partial text while someone is still talking instead of waiting for the pause
+STREAM_STEP = 0.5  # seconds of new audio between two passes in streaming mode
+STREAM_STATS = False  # print time-to-first-word and commit latency after every utterance
+VAD_BACKEND = "adaptive"  # threshold (fixed number from the calibration) / adaptive (follows the room noise)
+MIN_SPEECH_TIME = 0.2  # segments with less speech than this are dropped before they reach the model
+PRE_ROLL = 0.3  # seconds of audio kept from before the first speech chunk, so word onsets are not clipped
+POST_ROLL = 0.3  # seconds kept after the last speech chunk (None keeps the whole silence before the segment closes)
+MAX_SEGMENT_TIME = 30.0  # longer speech is cut into segments of this length (whisper only looks at 30 s)
+INCREMENTAL_MEL = True  # compute the log-mel features while recording, a closed segment goes straight to the encoder
+WHISPER_MODEL = "tiny"  # we got tiny / base / small / medium / large, "-int8" for the quantized backend (e.g. "base-int8"), "-jit" for TorchScript, None to choose at launch
+WORKERS = 1  # transcription processes, each with its own model (more than 1 for multi-core machines)
+BATCH_SIZE = 4  # when segments pile up, up to this many are transcribed in one go
+BATCH_WAIT = 0.0  # seconds to wait for more segments before starting a batch (0 = only take what is queued)
+COALESCE_WINDOW = 0  # e.g. 24: pack short segments into shared windows of up to this many seconds (0 = one window each)
+COALESCE_WAIT = 3.0  # with COALESCE_WINDOW, how long a segment may wait for others to share its window
+DYNAMIC_CONTEXT = False  # encode only the clip (rounded up to 5 s) instead of 30 s: faster on short segments, a bit less accurate
+METRICS_PORT = None  # e.g. 9100 serves http://127.0.0.1:9100/metrics (Prometheus) and /metrics.json
+METRICS_LOG = None  # file that gets one JSON line per segment with its timings ("-" for stderr)
+PROFILE = False  # sample the transcription thread's stack, served at /profile as collapsed stacks
+LATENCY_BUDGET = None  # seconds from speech to text; when the backlog would take longer, see OVERLOAD_POLICY
+OVERLOAD_POLICY = "coalesce"  # coalesce (merge queued segments, then drop the oldest) / drop (oldest first) / keep
+FALLBACK_MODEL = None  # e.g. "tiny", preloaded and used while WHISPER_MODEL can't keep up with LATENCY_BUDGET
+LANGUAGE_REDETECT = 60.0  # auto-detect: seconds of audio before the detected language is checked again
+NO_SPEECH_GATE = None  # skip decoding segments whose no-speech probability is above this (e.g. 0.8), None = off
 
 def get_unique_devices(p):
     devices = {}
@@ -32,94 +72,240 @@ def load_microphone_index():
         mic_index = int(f.read())
     return mic_index
 
-def record_audio(threshold, audio_queue):
-    p = pyaudio.PyAudio()
-    stream = p.open(format=FORMAT,
-                    channels=CHANNELS,
-                    rate=RATE,
-                    input=True,
-                    frames_per_buffer=CHUNK)
+def save_model_choice(model_name):
+    with open("model_settings.txt", "w") as f:
+        f.write(model_name)
+
+def load_model_choice():
+    if not os.path.exists("model_settings.txt"):
+        return None
+
+    with open("model_settings.txt", "r") as f:
+        model_name = f.read().strip()
+    return model_name or None
+
+def choose_model():
+    # int8 runs base or small about as fast as fp32 runs the size below, the first start quantizes and caches it
+    model_names = ["tiny", "tiny-int8", "base", "base-int8", "small", "small-int8"]
 
     while True:
-        frames = []
-        silent_frames = 0
-        recording_started = False
+        print("Choose the model:")
+        print("0. Last selection")
+        for i, name in enumerate(model_names):
+            print(f"{i + 1}. {name}")
 
-        while True:
-            audio_data = np.frombuffer(stream.read(CHUNK), dtype=np.int16)
-            if np.abs(audio_data).mean() < threshold:
-                silent_frames += 1
-            else:
-                silent_frames = 0
-                if not recording_started:
-                    recording_started = True
-            if recording_started:
-                frames.append(audio_data)
-            if silent_frames > 0.6 * RATE / CHUNK:  # stop recording after 0.5 seconds of silence
-                if recording_started:
+        try:
+            choice = int(input("Enter the number of the model you want to use: "))
+            if choice == 0:
+                last_model = load_model_choice()
+                if last_model is None:
+                    print("No previous model selection found. Please choose a model.")
+                else:
+                    model_name = last_model
                     break
+            elif 1 <= choice <= len(model_names):
+                model_name = model_names[choice - 1]
+                save_model_choice(model_name)
+                break
+            else:
+                print("Wrong option, please enter again.")
+        except ValueError:
+            print("Wrong option, please enter again.")
+    return model_name
+
+def open_source(mic_index=None):
+    return make_source(AUDIO_SOURCE, RATE, CHUNK, device_index=mic_index, process=CAPTURE_PROCESS)
+
+def record_audio(threshold, audio_queue, archive_queue=None, source=None):
+    if source is None:
+        source = open_source()
+
+    vad = make_vad(VAD_BACKEND, RATE, CHUNK, threshold)
+    resampler = Resampler(RATE, WHISPER_RATE)
+
+    def to_model_audio(audio):
+        # resample every chunk as it comes in, segments are model-ready when they are closed
+        return resampler.process(audio.astype(np.float32) / 32768.0)
+
+    segmenter = Segmenter(vad, RATE, CHUNK, silence_time=0.6, min_speech_time=MIN_SPEECH_TIME,
+                          pre_roll=PRE_ROLL, post_roll=POST_ROLL, max_segment_time=MAX_SEGMENT_TIME,
+                          mel=INCREMENTAL_MEL and not STREAMING,
+                          convert=to_model_audio, output_rate=WHISPER_RATE)  # stop recording after 0.6 seconds of silence
+
+    def buffered_seconds():
+        # audio recorded but not transcribed yet: the open segment plus everything queued
+        with audio_queue.mutex:
+            queued = sum(item.duration for item in audio_queue.queue if isinstance(item, Segment))
+        return queued + segmenter.open_seconds
+
+    metrics.set_gauge("buffered_seconds", buffered_seconds)
+    metrics.set_gauge("dropped_segments", lambda: segmenter.dropped)
 
-        # save the recorded audio to a file
-        filename = f"output_{int(time.time())}.wav"   # Change the file extension here (wav or mp3)
-        wf = wave.open(filename, "wb")
-        wf.setnchannels(CHANNELS)
-        wf.setsampwidth(p.get_sample_size(FORMAT))
-        wf.setframerate(RATE)
-        wf.writeframes(b''.join(frames))
-        wf.close()
-        audio_queue.put(filename)
-
-def process_audio_queue(audio_queue, language):
-    model = whisper.load_model("tiny")
-    print(f"Language set to [{language if language != 'auto' else 'auto-detect'}] Please give a minute to load the model")  # show the model is working and language it selects
     while True:
-        if not audio_queue.empty():
-            audio_file = audio_queue.get()
-            try:
-                result = model.transcribe(audio_file, language=language if language != "auto" else None)  # Handle the "auto" option
-                print(result["text"])
-            except RuntimeError as e:
-                print(f"Error processing audio file {audio_file}: {e}")
-            except Exception as e:
-                print(f"Unexpected error processing audio file {audio_file}: {e}")
-            finally:
-                try:
-                    os.remove(audio_file)
-                except Exception as e:
-                    print(f"Error removing audio file {audio_file}: {e}")
-
-
-def measure_threshold():
-    p = pyaudio.PyAudio()
-    stream = p.open(format=FORMAT,
-                    channels=CHANNELS,
-                    rate=RATE,
-                    input=True,
-                    frames_per_buffer=CHUNK)
+        audio_data = source.read(CHUNK)
+        if audio_data is None:
+            segment = segmenter.flush()
+        else:
+            with metrics.span("capture"):
+                segment = segmenter.push(audio_data)
+            if STREAMING:
+                for audio in segmenter.added:
+                    audio_queue.put(audio)
+
+        # hand the recorded audio over as a float32 buffer, no temp file needed
+        if segment is not None:
+            metrics.observe("segment_close", segment.closed_at - segment.speech_end_at)
+            if archive_queue is not None:
+                archive_queue.put(segment)
+            if STREAMING:
+                audio_queue.put(None)  # end of utterance, the stream commits what is left
+            else:
+                segment.queued_at = time.time()
+                audio_queue.put(segment)
+
+        if audio_data is None:  # the source ended (file, pipe or socket)
+            source.close()
+            audio_queue.put(END_OF_SOURCE)  # the transcription stops after what is queued
+            return
+
+def archive_audio(archive_queue):
+    # optional sink, writes the segments to disk without holding up transcription
+    while True:
+        segment = archive_queue.get()
+        filename = f"output_{int(time.time() * 1000)}.wav"   # Change the file extension here (wav or mp3)
+        try:
+            wf = wave.open(filename, "wb")
+            wf.setnchannels(CHANNELS)
+            wf.setsampwidth(pyaudio.get_sample_size(FORMAT))
+            wf.setframerate(segment.rate)
+            wf.writeframes((np.clip(segment.audio, -1, 1) * 32767).astype(np.int16).tobytes())
+            wf.close()
+        except Exception as e:
+            print(f"Error archiving audio file {filename}: {e}")
+
+def process_audio_queue(audio_queue, language, model_loader, on_result=None, scheduler=None):
+    print(f"Language set to [{language if language != 'auto' else 'auto-detect'}]")  # show the model is working and language it selects
+    model = model_loader.get()
+    print(model_loader.report())
+    import transcriber
+    if PROFILE:
+        metrics.profile_thread()
+    controller = None
+    if language == "auto":
+        controller = LanguageController(redetect_every=LANGUAGE_REDETECT)  # detect once, not for every segment
+    gate = NoSpeechGate(NO_SPEECH_GATE) if NO_SPEECH_GATE is not None else None
+    ready = time.time()
+    metrics.set_gauge("worker_utilization", lambda: metrics.registry.total("model") / max(time.time() - ready, 1e-9))
+    while True:
+        if scheduler is None:
+            current = model
+            if COALESCE_WINDOW:
+                batch = transcriber.collect_batch(audio_queue, BATCH_SIZE * 8, COALESCE_WAIT)
+            else:
+                batch = transcriber.collect_batch(audio_queue, BATCH_SIZE, BATCH_WAIT)  # blocks while there is nothing to do
+            ended = any(item is END_OF_SOURCE for item in batch)
+            batch = [item for item in batch if item is not END_OF_SOURCE]
+        else:
+            current, batch = scheduler.take(audio_queue, BATCH_SIZE, BATCH_WAIT)  # may switch models, merge or drop
+            ended = scheduler.ended and not scheduler.backlog
+        if not batch:  # just the end of the source
+            return
+        try:
+            shown = controller.language if controller is not None else None
+            texts = transcriber.transcribe_segments(current, batch, controller or language, fp16=False,
+                                                    coalesce=COALESCE_WINDOW, batch_size=BATCH_SIZE, dynamic=DYNAMIC_CONTEXT,
+                                                    gate=gate)
+            if scheduler is not None:
+                scheduler.done(batch)
+            if controller is not None and controller.language != shown:
+                print(f"Language detected [{controller.language}]")
+            for segment, text in zip(batch, texts):
+                with metrics.span("output"):
+                    if on_result is None:
+                        if text:  # silent segments come back empty, they are counted, not printed
+                            print(text)
+                    else:
+                        on_result(segment, text)  # used by the benchmark
+                metrics.inc("segments")
+                metrics.observe("latency", time.time() - segment.speech_end_at)
+                metrics.log("segment", text=text, **segment.timings())
+        except RuntimeError as e:
+            print(f"Error processing audio segment: {e}")
+            metrics.inc("errors")
+            metrics.log("error", error=str(e))
+        except Exception as e:
+            print(f"Unexpected error processing audio segment: {e}")
+            metrics.inc("errors")
+            metrics.log("error", error=str(e))
+        if ended:  # a file or stream that ended, everything it had is transcribed
+            return
+
+def process_audio_queue_pool(audio_queue, language, pool):
+    print(f"Language set to [{language if language != 'auto' else 'auto-detect'}]")
+    try:
+        pool.wait_ready()
+        print(f"{pool.workers} workers ({pool.threads} threads each) ready {pool.time_to_ready:.1f} s after launch")
+        for i in range(pool.workers):
+            metrics.set_gauge(f"worker_{i}_utilization", lambda i=i: pool.utilization(i))
+        pool.feed(audio_queue, language)
+        for seq, text, error in pool.results_in_order():  # printed in recording order, whichever worker finishes first
+            if error is None:
+                if text:
+                    with metrics.span("output"):
+                        print(text)
+                metrics.inc("segments")
+                metrics.log("segment", seq=seq, text=text)
+            else:
+                print(f"Error processing audio segment {seq}: {error}")
+                metrics.inc("errors")
+                metrics.log("error", seq=seq, error=error)
+    except RuntimeError as e:  # a worker failed to load its model or died
+        print(f"Transcription stopped: {e}")
+    pool.close()
+
+def stream_audio_queue(audio_queue, language, model_loader):
+    print(f"Language set to [{language if language != 'auto' else 'auto-detect'}]")
+    model = model_loader.get()
+    print(model_loader.report())
+    if PROFILE:
+        metrics.profile_thread()
+    stream = streaming.StreamingTranscriber(model, language, step=STREAM_STEP, fp16=False)
+    stream.run(audio_queue, print_stats=STREAM_STATS)
+
+
+def measure_threshold(source=None):
+    if source is None:
+        source = open_source()
 
     print("Please be quiet for 5 seconds while we measure the background noise...")
 
     frames = []
     for i in range(0, int(RATE / CHUNK * 5)):
-        data = stream.read(CHUNK)
+        data = source.read(CHUNK)
+        if data is None:
+            break
         frames.append(data)
 
     print("Please speak for 5 seconds...")
 
     frames2 = []
     for i in range(0, int(RATE / CHUNK * 5)):
-        data = stream.read(CHUNK)
+        data = source.read(CHUNK)
+        if data is None:
+            break
         frames2.append(data)
 
-    stream.stop_stream()
-    stream.close()
-    p.terminate()
+    source.close()
+    if not frames or not frames2:
+        # an empty file, or stdin / the socket closed before any audio came in
+        raise RuntimeError(f"The audio source ({AUDIO_SOURCE}) ended before the calibration was done, "
+                           f"set a threshold by hand (option 2) or use VAD_BACKEND = \"adaptive\"")
 
-    audio_data = np.frombuffer(b''.join(frames), dtype=np.int16)
+    audio_data = np.concatenate(frames)
     background = np.abs(audio_data).mean()
     print(f"Background noise set to {background}")
 
-    audio_data = np.frombuffer(b''.join(frames2), dtype=np.int16)
+    audio_data = np.concatenate(frames2)
     speech = np.abs(audio_data).mean()
     print(f"Speech volume set to {speech}")
 
@@ -141,7 +327,7 @@ def load_threshold():
         threshold = float(f.read())
     return threshold
 
-def choose_threshold():
+def choose_threshold(mic_index=None):
     while True:
         print("Choose an option to set the threshold:")
         print("0. Use old calibration number")
@@ -151,14 +337,14 @@ def choose_threshold():
         try:
             choice = int(input("Enter the number of the option you want to use: "))
             if choice == 1:
-                threshold = measure_threshold()
+                threshold = measure_threshold(open_source(mic_index))
                 save_threshold(threshold)
                 break
             elif choice == 0:
                 old_calibration = load_threshold()
                 if old_calibration is None:
                     print("No previous calibration found. Starting calibration...")
-                    threshold = measure_threshold()
+                    threshold = measure_threshold(open_source(mic_index))
                     save_threshold(threshold)
                 else:
                     threshold = old_calibration
@@ -241,43 +427,73 @@ def choose_language():
 
 
 if __name__ == "__main__":
-    print("Available microphones:")
-    p = pyaudio.PyAudio()
-    unique_devices = get_unique_devices(p)
-    print("0. Use previous microphone")
-    for name, index in unique_devices.items():
-        print(f"{index + 1}: {name}")  # Add 1 to the index displayed
-    p.terminate()
+    if WHISPER_MODEL is None:
+        WHISPER_MODEL = choose_model()
+
+    # start loading right away, while the menus are up
+    if WORKERS > 1 and not STREAMING:
+        pool = TranscriptionPool(WORKERS, WHISPER_MODEL, launched=LAUNCHED)
+    else:
+        model_loader = BackgroundModel(WHISPER_MODEL, launched=LAUNCHED)
+        fallback_loader = BackgroundModel(FALLBACK_MODEL, launched=LAUNCHED) if FALLBACK_MODEL and LATENCY_BUDGET else None
+
+    mic_index = None
+    if AUDIO_SOURCE == "mic":
+        print("Available microphones:")
+        p = pyaudio.PyAudio()
+        unique_devices = get_unique_devices(p)
+        print("0. Use previous microphone")
+        for name, index in unique_devices.items():
+            print(f"{index + 1}: {name}")  # Add 1 to the index displayed
+        p.terminate()
 
-    while True:
-        try:
-            mic_index_input = int(input("Enter the number of the microphone you want to use: "))
-            if mic_index_input == 0:
-                last_mic_index = load_microphone_index()
-                if last_mic_index is None:
-                    print("No previous microphone selection found. Please choose a microphone.")
-                else:
-                    mic_index = last_mic_index
+        while True:
+            try:
+                mic_index_input = int(input("Enter the number of the microphone you want to use: "))
+                if mic_index_input == 0:
+                    last_mic_index = load_microphone_index()
+                    if last_mic_index is None:
+                        print("No previous microphone selection found. Please choose a microphone.")
+                    else:
+                        mic_index = last_mic_index
+                        break
+                elif mic_index_input - 1 in unique_devices.values():  # Subtract 1 from the input
+                    mic_index = mic_index_input - 1  # Subtract 1 from the input to get the actual index
+                    save_microphone_index(mic_index)
                     break
-            elif mic_index_input - 1 in unique_devices.values():  # Subtract 1 from the input
-                mic_index = mic_index_input - 1  # Subtract 1 from the input to get the actual index
-                save_microphone_index(mic_index)
-                break
-            else:
+                else:
+                    print("Wrong option, please enter again.")
+            except ValueError:
                 print("Wrong option, please enter again.")
-        except ValueError:
-            print("Wrong option, please enter again.")
 
-    threshold = choose_threshold()
+    threshold = choose_threshold(mic_index) if VAD_BACKEND == "threshold" else None
     language = choose_language()
 
     audio_queue = queue.Queue(maxsize=0)
-
-    record_thread = threading.Thread(target=record_audio, args=(threshold, audio_queue))
-    process_thread = threading.Thread(target=process_audio_queue, args=(audio_queue, language))
+    metrics.set_gauge("queue_depth", audio_queue.qsize)
+    if METRICS_LOG:
+        metrics.open_log(METRICS_LOG)
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
+        print(f"Metrics on http://127.0.0.1:{METRICS_PORT}/metrics")
+    archive_queue = None
+    if ARCHIVE_AUDIO:
+        archive_queue = queue.Queue(maxsize=0)
+        threading.Thread(target=archive_audio, args=(archive_queue,), daemon=True).start()
+
+    source = open_source(mic_index)
+    record_thread = threading.Thread(target=record_audio, args=(threshold, audio_queue, archive_queue, source), daemon=True)
+    if STREAMING:
+        process_thread = threading.Thread(target=stream_audio_queue, args=(audio_queue, language, model_loader))
+    elif WORKERS > 1:
+        process_thread = threading.Thread(target=process_audio_queue_pool, args=(audio_queue, language, pool))
+    else:
+        scheduler = None
+        if LATENCY_BUDGET:
+            scheduler = LatencyScheduler(model_loader, fallback_loader, budget=LATENCY_BUDGET, policy=OVERLOAD_POLICY)
+        process_thread = threading.Thread(target=process_audio_queue, args=(audio_queue, language, model_loader, None, scheduler))
 
     record_thread.start()
     process_thread.start()
 
-    record_thread.join()
-    process_thread.join()
+    process_thread.join()  # the program ends with the transcription, the recording thread is a daemon
@@ -0,0 +1,282 @@
+import argparse
+import asyncio
+import json
+import struct
+import threading
+import time
+
+import numpy as np
+
+import metrics
+from model_loader import BackgroundModel
+from resampler import Resampler
+from scheduler import FairQueue
+from segmenter import Segmenter
+from speech_gate import NoSpeechGate
+from vad import make_vad
+
+# Server mode: one process, one model, many rooms.
+#
+#   python Whisper_RT_Server.py --model base --port 8765
+#   python Server_benchmark.py --streams 1,2,4,8      (load generator)
+#
+# Plain TCP, every message is a frame: a 4-byte big-endian length, then the payload.
+#   client -> server: first a JSON hello {"rate": 16000, "language": "en"} (both optional),
+#                     then int16 mono PCM frames of any size, then an empty frame for the end
+#   server -> client: one JSON frame per segment {"start", "end", "text", "latency"}, and
+#                     {"done": true} once everything sent before the end frame is transcribed,
+#                     or {"error": "..."} before the connection is closed on a bad hello
+# Every connection gets its own VAD and Segmenter (the silence logic of record_audio). The
+# segments of all connections go into one FairQueue, which the model thread takes batches
+# from in turn, one segment per room. The per-chunk work (VAD, resampling, features) runs on
+# the event loop's thread pool, so a busy room doesn't hold up the reads of the others.
+# It listens on 127.0.0.1 unless told otherwise (--host 0.0.0.0), there is no authentication.
+
+WHISPER_RATE = 16000
+CHUNK = 1024
+HEADER = struct.Struct(">I")
+MAX_FRAME = 16 * 1024 * 1024
+MAX_RATE = 384000
+
+
+async def read_frame(reader):
+    (length,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+    if length > MAX_FRAME:
+        raise ValueError(f"frame of {length} bytes")
+    return await reader.readexactly(length)
+
+
+def frame(payload):
+    return HEADER.pack(len(payload)) + payload
+
+
+def parse_hello(data, default_language):
+    # (rate, language) from the client's first frame, ValueError when it isn't a usable hello
+    hello = json.loads(data.decode("utf-8") or "{}")
+    if not isinstance(hello, dict):
+        raise ValueError("the hello is not a JSON object")
+    rate = hello.get("rate", WHISPER_RATE)
+    if type(rate) is not int or not 0 < rate <= MAX_RATE:
+        raise ValueError(f"bad rate {rate!r}")
+    language = hello.get("language", default_language)
+    if not isinstance(language, str):
+        raise ValueError(f"bad language {language!r}")
+    return rate, language
+
+
+class Rejected(Exception):
+    # the connection gets {"error": ...} and is closed
+    pass
+
+
+class Stream:
+    # one connection: its segmentation state and where its results go
+    def __init__(self, number, writer, loop, rate, language, args):
+        self.number = number
+        self.writer = writer
+        self.loop = loop
+        self.rate = rate
+        self.language = language
+        resampler = Resampler(rate, WHISPER_RATE) if rate != WHISPER_RATE else None
+
+        def to_model_audio(audio):
+            audio = audio.astype(np.float32) / 32768.0
+            return resampler.process(audio) if resampler is not None else audio
+
+        vad = make_vad(args.vad, rate, CHUNK, args.threshold)
+        self.segmenter = Segmenter(vad, rate, CHUNK, silence_time=args.silence, min_speech_time=args.min_speech,
+                                   pre_roll=args.pre_roll, post_roll=args.post_roll, convert=to_model_audio,
+                                   output_rate=WHISPER_RATE, mel=True)
+        self.pending = np.zeros(0, dtype=np.int16)
+        self.outstanding = 0        # segments queued or being transcribed
+        self.ended = False
+        self.closed = False
+
+    def push(self, data):
+        # PCM bytes in, closed segments out
+        self.pending = np.concatenate([self.pending, np.frombuffer(data[:len(data) // 2 * 2], dtype=np.int16)])
+        n = len(self.pending) // CHUNK
+        segments = [self.segmenter.push(chunk) for chunk in self.pending[:n * CHUNK].reshape(n, CHUNK)]
+        self.pending = self.pending[n * CHUNK:]
+        return [segment for segment in segments if segment is not None]
+
+    def deliver(self, segment, text):
+        # on the event loop, called from the model thread through call_soon_threadsafe
+        self.outstanding -= 1
+        if self.closed:
+            return
+        if text is not None:
+            self.send({"start": round(segment.start, 3), "end": round(segment.end, 3), "text": text.strip(),
+                       "latency": round(segment.done_at - segment.speech_end_at, 3)})
+        self.finish_if_done()
+
+    def finish_if_done(self):
+        if self.ended and self.outstanding == 0 and not self.closed:
+            self.send({"done": True})
+            self.closed = True
+            self.writer.close()
+
+    def fail(self, message):
+        if not self.closed:
+            self.send({"error": message})
+            self.closed = True
+            self.writer.close()
+
+    def send(self, message):
+        self.writer.write(frame(json.dumps(message).encode("utf-8")))
+
+
+class Server:
+    def __init__(self, audio_queue, model_loader, args):
+        self.audio_queue = audio_queue
+        self.model_loader = model_loader
+        self.args = args
+        self.error = None           # why the model could not be loaded, every connection is told
+        self.streams = set()
+        self.connections = 0
+        metrics.set_gauge("streams", lambda: len(self.streams))
+
+    def queue(self, stream, segment):
+        segment.stream = stream
+        segment.queued_at = time.time()
+        stream.outstanding += 1
+        self.audio_queue.put(segment)
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        stream = None
+        number = self.connections
+        loop = asyncio.get_running_loop()
+        try:
+            try:
+                rate, language = parse_hello(await read_frame(reader), self.args.language)
+            except ValueError as e:
+                raise Rejected(e)
+            if self.error is not None:
+                raise Rejected(self.error)
+            stream = Stream(number, writer, loop, rate, language, self.args)
+            self.streams.add(stream)
+            metrics.log("stream_open", stream=stream.number, rate=stream.rate, language=stream.language)
+            while True:
+                data = await read_frame(reader)
+                if not data:
+                    break
+                for segment in await loop.run_in_executor(None, stream.push, data):
+                    self.queue(stream, segment)
+            segment = await loop.run_in_executor(None, stream.segmenter.flush)
+            if segment is not None:
+                self.queue(stream, segment)
+            stream.ended = True
+            stream.finish_if_done()
+            await writer.wait_closed()
+        except Rejected as e:
+            print(f"Stream {number} rejected: {e}")
+            writer.write(frame(json.dumps({"error": str(e)}).encode("utf-8")))
+            writer.close()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError) as e:
+            if stream is None or not stream.closed:    # not after fail(), that closed it
+                print(f"Stream {number} dropped: {e}")
+            writer.close()
+        except Exception as e:
+            print(f"Stream {number} failed: {e}")
+            metrics.inc("errors")
+            writer.close()
+        finally:
+            if stream is not None:
+                stream.closed = True
+                self.streams.discard(stream)
+                metrics.log("stream_close", stream=stream.number)
+
+    async def watch_model(self):
+        # the model loads in the background while streams connect; if it fails, the open streams
+        # are closed with the error and new ones are rejected
+        await asyncio.get_running_loop().run_in_executor(None, self.model_loader.ready.wait)
+        if self.model_loader.error is not None:
+            self.error = f"the {self.model_loader.name} model could not be loaded: {self.model_loader.error}"
+            print(f"No transcription, {self.error}")
+            for stream in list(self.streams):
+                stream.fail(self.error)
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Listening on tcp://{host}:{port}")
+        watcher = asyncio.create_task(self.watch_model())  # referenced until the server stops
+        async with server:
+            await server.serve_forever()
+        watcher.cancel()
+
+
+def process_streams(audio_queue, model_loader, batch_size, batch_wait, fp16=False, gate=None):
+    # the model thread: batches across rooms, grouped by language, results back to each room
+    import transcriber
+
+    try:
+        model = model_loader.get()
+    except Exception:
+        return  # Server.watch_model tells the clients
+    print(model_loader.report())
+    while True:
+        batch = transcriber.collect_batch(audio_queue, batch_size, batch_wait)
+        live = [segment for segment in batch if not segment.stream.closed]
+        for segment in batch:
+            if segment.stream.closed:
+                segment.stream.loop.call_soon_threadsafe(segment.stream.deliver, segment, None)
+        groups = {}
+        for segment in live:
+            groups.setdefault(segment.stream.language, []).append(segment)
+        for language, segments in groups.items():
+            try:
+                texts = transcriber.transcribe_segments(model, segments, language, fp16=fp16, gate=gate)
+            except Exception as e:
+                print(f"Error transcribing: {e}")
+                metrics.inc("errors")
+                texts = [None] * len(segments)
+            for segment, text in zip(segments, texts):
+                metrics.inc("segments")
+                if text is not None:
+                    metrics.observe("latency", segment.done_at - segment.speech_end_at)
+                segment.stream.loop.call_soon_threadsafe(segment.stream.deliver, segment, text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcribe many PCM streams over TCP with one shared model")
+    parser.add_argument("--host", default="127.0.0.1", help="0.0.0.0 to accept connections from other machines")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--model", default="base")
+    parser.add_argument("--device", default=None, help="cuda or cpu (default: cuda if available)")
+    parser.add_argument("--language", default="en", help="default for clients that don't send one, or auto")
+    parser.add_argument("--batch-size", type=int, default=8, help="segments per model call, across rooms")
+    parser.add_argument("--batch-wait", type=float, default=0.05, help="seconds to wait for more segments")
+    parser.add_argument("--vad", default="adaptive", help="threshold or adaptive")
+    parser.add_argument("--threshold", type=float, default=None, help="needed with --vad threshold")
+    parser.add_argument("--silence", type=float, default=0.8, help="seconds of silence that close a segment")
+    parser.add_argument("--min-speech", type=float, default=0.2)
+    parser.add_argument("--pre-roll", type=float, default=0.3)
+    parser.add_argument("--post-roll", type=float, default=0.3)
+    parser.add_argument("--no-speech-gate", type=float, default=None,
+                        help="skip decoding segments whose no-speech probability is above this, e.g. 0.8")
+    parser.add_argument("--metrics-port", type=int, default=None)
+    args = parser.parse_args()
+    if args.vad == "threshold" and args.threshold is None:
+        parser.error("--vad threshold needs --threshold")
+
+    model_loader = BackgroundModel(args.model, device=args.device)
+    audio_queue = FairQueue()
+    metrics.set_gauge("queue_depth", audio_queue.qsize)
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+        print(f"Metrics on http://127.0.0.1:{args.metrics_port}/metrics")
+
+    gate = NoSpeechGate(args.no_speech_gate) if args.no_speech_gate is not None else None
+    import torch
+    fp16 = (args.device or ("cuda" if torch.cuda.is_available() else "cpu")) == "cuda"
+    threading.Thread(target=process_streams,
+                     args=(audio_queue, model_loader, args.batch_size, args.batch_wait, fp16, gate), daemon=True).start()
+    try:
+        asyncio.run(Server(audio_queue, model_loader, args).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
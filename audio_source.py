@@ -0,0 +1,379 @@
+import multiprocessing as mp
+import socket
+import sys
+import time
+import traceback
+import wave
+
+import numpy as np
+
+import metrics
+from resampler import Resampler
+
+
+class AudioSource:
+    # Where record_audio and measure_threshold get their audio from. read() returns `frames`
+    # int16 mono samples at self.rate, or None once the source has ended.
+
+    rate = None
+
+    def read(self, frames):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MicrophoneSource(AudioSource):
+    def __init__(self, rate, chunk, device_index=None):
+        import pyaudio
+
+        self.rate = rate
+        self.overflows = 0      # chunks lost because the capture thread fell behind
+        self.overflow_code = pyaudio.paInputOverflowed
+        self.p = pyaudio.PyAudio()
+        self.stream = self.p.open(format=pyaudio.paInt16,
+                                  channels=1,
+                                  rate=rate,
+                                  input=True,
+                                  input_device_index=device_index,
+                                  frames_per_buffer=chunk)
+
+    def read(self, frames):
+        while True:
+            try:
+                return np.frombuffer(self.stream.read(frames), dtype=np.int16)
+            except IOError as e:
+                if e.errno != self.overflow_code:
+                    raise
+                self.overflows += 1
+                metrics.inc("input_overflows")
+
+    def close(self):
+        self.stream.stop_stream()
+        self.stream.close()
+        self.p.terminate()
+
+
+class SharedRing:
+    # int16 samples in shared memory, written by the capture process and read by the main one.
+    # One writer, one reader, no locks: the writer copies the samples in and then moves the
+    # `written` count on, the reader copies out and checks afterwards that the writer has not
+    # lapped it meanwhile. Losses are counted in the header on both sides. A writer that isn't
+    # held to real time (files, sockets) waits for room instead (wait_for_room), nothing is lost.
+
+    WRITTEN, OVERFLOWS, DROPPED, ENDED, FAILED, STOP, READ = range(7)
+    HEADER = 64     # bytes, 8 int64 slots
+
+    def __init__(self, capacity, name=None):
+        from multiprocessing import shared_memory
+
+        self.capacity = capacity
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=self.HEADER + capacity * 2)
+        self.header = np.ndarray(8, dtype=np.int64, buffer=self.shm.buf)
+        self.samples = np.ndarray(capacity, dtype=np.int16, buffer=self.shm.buf, offset=self.HEADER)
+        if name is None:
+            self.header[:] = 0
+        self.position = 0   # reader side, next sample to read
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, audio):
+        start = int(self.header[self.WRITTEN]) + max(len(audio) - self.capacity, 0)
+        audio = audio[-self.capacity:]
+        i = start % self.capacity
+        n = min(len(audio), self.capacity - i)
+        self.samples[i:i + n] = audio[:n]
+        self.samples[:len(audio) - n] = audio[n:]
+        self.header[self.WRITTEN] = start + len(audio)
+
+    def available(self):
+        return int(self.header[self.WRITTEN]) - self.position
+
+    def wait_for_room(self, samples, poll=0.005):
+        # writer side: blocks until `samples` fit without overwriting unread audio, False on STOP
+        while int(self.header[self.WRITTEN]) - int(self.header[self.READ]) + samples > self.capacity:
+            if self.header[self.STOP]:
+                return False
+            time.sleep(poll)
+        return True
+
+    def read(self, frames):
+        # up to `frames` samples, fewer if there are not that many yet
+        while True:
+            if self.available() > self.capacity:
+                self.skip(self.available() - self.capacity)
+            start = self.position
+            n = min(frames, self.available())
+            i = start % self.capacity
+            first = min(n, self.capacity - i)
+            audio = np.concatenate((self.samples[i:i + first], self.samples[:n - first]))
+            behind = int(self.header[self.WRITTEN]) - start - self.capacity
+            if behind <= 0:
+                self.position += n
+                self.header[self.READ] = self.position
+                return audio
+            self.skip(behind)   # overwritten while it was copied
+
+    def skip(self, samples):
+        self.position += samples
+        self.header[self.READ] = self.position
+        self.header[self.DROPPED] += samples
+
+    def close(self, unlink=False):
+        self.header = self.samples = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def capture_main(ring_name, capacity, spec, rate, chunk, device_index):
+    # runs in the capture process: the source's audio goes into the ring until the main
+    # process sets STOP or the source ends
+    ring = SharedRing(capacity, ring_name)
+    try:
+        if spec.partition(":")[0] == "mic":
+            capture_microphone(ring, rate, chunk, int(spec[4:]) if spec[4:] else device_index)
+        else:
+            # not a live device: waits for the reader rather than overwrite what it hasn't read,
+            # so a file replayed faster than real time still arrives whole
+            source = make_source(spec, rate, chunk, device_index)
+            while not ring.header[ring.STOP]:
+                audio = source.read(chunk)
+                if audio is None or not ring.wait_for_room(len(audio)):
+                    break
+                ring.write(audio)
+            source.close()
+    except Exception:
+        traceback.print_exc()
+        ring.header[ring.FAILED] = 1
+    finally:
+        ring.header[ring.ENDED] = 1
+        ring.close()
+
+
+def capture_microphone(ring, rate, chunk, device_index=None):
+    # PortAudio calls back from its own thread for every chunk, nothing here waits on a read
+    import pyaudio
+
+    def callback(data, frame_count, time_info, status):
+        if status & pyaudio.paInputOverflow:
+            ring.header[ring.OVERFLOWS] += 1
+        ring.write(np.frombuffer(data, dtype=np.int16))
+        return None, pyaudio.paContinue
+
+    p = pyaudio.PyAudio()
+    stream = p.open(format=pyaudio.paInt16,
+                    channels=1,
+                    rate=rate,
+                    input=True,
+                    input_device_index=device_index,
+                    frames_per_buffer=chunk,
+                    stream_callback=callback)
+    stream.start_stream()
+    while stream.is_active() and not ring.header[ring.STOP]:
+        time.sleep(0.05)
+    stream.stop_stream()
+    stream.close()
+    p.terminate()
+
+
+class ProcessSource(AudioSource):
+    # Any other source, read in a capture process of its own and handed over through a
+    # SharedRing of `seconds` of audio. The recording thread shares the GIL with the model;
+    # when the model holds it for a while, a blocking stream.read falls behind and PortAudio
+    # drops input. The capture process is not held up by anything in this one, and the ring
+    # holds far more than the few chunks PortAudio buffers.
+    # Counted: input_overflows (PortAudio reported lost input) and capture_dropped_samples
+    # (the ring was overwritten before this side read it).
+
+    POLL = 0.005    # seconds between looks at the ring while waiting for a chunk
+
+    def __init__(self, spec, rate, chunk, device_index=None, seconds=10.0):
+        self.rate = rate
+        self.ring = SharedRing(int(rate * seconds))
+        self.overflows = 0
+        self.dropped = 0
+        context = mp.get_context("spawn")
+        self.process = context.Process(target=capture_main,
+                                       args=(self.ring.name, self.ring.capacity, spec, rate, chunk, device_index),
+                                       daemon=True)
+        self.process.start()
+
+    def update_counters(self):
+        overflows, dropped = int(self.ring.header[SharedRing.OVERFLOWS]), int(self.ring.header[SharedRing.DROPPED])
+        if overflows > self.overflows:
+            metrics.inc("input_overflows", overflows - self.overflows)
+        if dropped > self.dropped:
+            metrics.inc("capture_dropped_samples", dropped - self.dropped)
+        self.overflows, self.dropped = overflows, dropped
+
+    def read(self, frames):
+        while self.ring.available() < frames:
+            if self.ring.header[SharedRing.ENDED]:
+                if self.ring.header[SharedRing.FAILED]:
+                    raise RuntimeError("The capture process failed, see the error above")
+                break
+            if not self.process.is_alive():
+                raise RuntimeError(f"The capture process exited with code {self.process.exitcode}")
+            time.sleep(self.POLL)
+        audio = self.ring.read(frames)
+        self.update_counters()
+        if len(audio) == 0:
+            return None     # the source ended and everything was read
+        return audio
+
+    def close(self):
+        self.ring.header[SharedRing.STOP] = 1
+        self.process.join(timeout=5)
+        self.update_counters()
+        self.ring.close(unlink=True)
+
+
+class PCMSource(AudioSource):
+    # Raw int16 mono PCM from a binary file object, converted to the rate the caller wants.
+
+    def __init__(self, f, file_rate, rate=None):
+        self.f = f
+        self.rate = rate or file_rate
+        self.resampler = Resampler(file_rate, self.rate) if self.rate != file_rate else None
+        self.pending = np.zeros(0, dtype=np.int16)
+
+    def read_raw(self, frames):
+        data = self.f.read(frames * 2)
+        if not data:
+            return None
+        return np.frombuffer(data[:len(data) // 2 * 2], dtype=np.int16)
+
+    def read(self, frames):
+        while len(self.pending) < frames:
+            if self.resampler is None:
+                raw = self.read_raw(frames - len(self.pending))
+            else:
+                raw = self.read_raw(frames)
+            if raw is None:
+                if len(self.pending) == 0:
+                    return None
+                break   # last, short chunk
+            if self.resampler is not None:
+                raw = np.clip(self.resampler.process(raw.astype(np.float32)), -32768, 32767).astype(np.int16)
+            self.pending = np.concatenate([self.pending, raw])
+        audio, self.pending = self.pending[:frames], self.pending[frames:]
+        return audio
+
+    def close(self):
+        self.f.close()
+
+
+class FileSource(PCMSource):
+    # WAV or raw PCM file, replayed at real time (speed=1), N times faster than real time
+    # (speed=N) or as fast as possible (speed=0). loop=True starts over at the end, for
+    # pushing hours of audio through the pipeline from a short recording.
+
+    def __init__(self, path, rate=None, speed=1.0, loop=False, raw_rate=None):
+        self.path = path
+        self.raw_rate = raw_rate or rate    # raw PCM has no header, by default it is taken to be at `rate`
+        self.speed = speed
+        self.loop = loop
+        f, file_rate = self.open()
+        super().__init__(f, file_rate, rate)
+        self.started = None
+        self.samples = 0
+
+    def open(self):
+        if self.path.lower().endswith(".wav"):
+            wf = wave.open(self.path, "rb")
+            if wf.getsampwidth() != 2 or wf.getnchannels() != 1:
+                raise ValueError(f"{self.path}: only 16-bit mono wav files are supported")
+            return WaveReader(wf), wf.getframerate()
+        return open(self.path, "rb"), self.raw_rate
+
+    def read_raw(self, frames):
+        raw = super().read_raw(frames)
+        if raw is None and self.loop:
+            self.f.close()
+            self.f, _ = self.open()
+            raw = super().read_raw(frames)
+        return raw
+
+    def read(self, frames):
+        audio = super().read(frames)
+        if audio is None:
+            return None
+        if self.started is None:
+            self.started = time.perf_counter()
+        self.samples += len(audio)
+        if self.speed > 0:
+            # pace against the wall clock so small sleep errors don't add up
+            due = self.started + self.samples / self.rate / self.speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        return audio
+
+
+class WaveReader:
+    # file-like read(n_bytes) over the frames of an open wave file
+    def __init__(self, wf):
+        self.wf = wf
+
+    def read(self, n_bytes):
+        return self.wf.readframes(n_bytes // 2)
+
+    def close(self):
+        self.wf.close()
+
+
+class StdinSource(PCMSource):
+    # raw int16 mono PCM piped in, e.g. `ffmpeg -i talk.mp3 -f s16le -ac 1 -ar 16000 - | python ...`
+    def __init__(self, rate, pipe_rate=None):
+        super().__init__(sys.stdin.buffer, pipe_rate or rate, rate)
+
+    def close(self):
+        pass
+
+
+class SocketSource(PCMSource):
+    # Listens on host:port and reads raw int16 mono PCM from the first client that connects.
+    def __init__(self, host, port, rate, stream_rate=None):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(1)
+        print(f"Waiting for audio on tcp://{host}:{port} ...")
+        self.connection, _ = self.server.accept()
+        super().__init__(self.connection.makefile("rb"), stream_rate or rate, rate)
+
+    def close(self):
+        self.f.close()
+        self.connection.close()
+        self.server.close()
+
+
+def make_source(spec, rate, chunk, device_index=None, process=False):
+    # mic | mic:<index> | file:<path>[@<N>x|@max][@loop] | stdin[:<rate>] | tcp:<host>:<port>[:<rate>]
+    # process=True records in a separate process (ProcessSource), not for stdin
+    kind, _, rest = spec.partition(":")
+    if process and kind != "stdin":
+        return ProcessSource(spec, rate, chunk, device_index)
+    if kind == "mic":
+        return MicrophoneSource(rate, chunk, int(rest) if rest else device_index)
+    if kind == "file":
+        path, *options = rest.split("@")
+        speed, loop = 1.0, False
+        for option in options:
+            if option == "loop":
+                loop = True
+            elif option == "max":
+                speed = 0.0
+            else:
+                speed = float(option.rstrip("x"))
+        return FileSource(path, rate, speed=speed, loop=loop)
+    if kind == "stdin":
+        return StdinSource(rate, int(rest) if rest else None)
+    if kind == "tcp":
+        host, port, *stream_rate = rest.split(":")
+        return SocketSource(host, int(port), rate, int(stream_rate[0]) if stream_rate else None)
+    raise ValueError(f"Unknown audio source: {spec}")
@@ -0,0 +1,34 @@
+import whisper
+
+import dynamic_encoder
+
+# transcribe_batch runs the encoder and the decoder through the model's backend:
+#
+#   backend.encode(mel)                       -> audio features (30 s windows)
+#   backend.decode(audio_features, options)   -> one DecodingResult per segment
+#
+# The default is whisper itself in eager PyTorch. model_loader.load_model("<size>-jit") attaches
+# the TorchScript backend from exported.py as model.backend instead. Language detection and the
+# rare model.transcribe fallback always stay on the eager model.
+
+
+class EagerBackend:
+    name = "eager"
+
+    def __init__(self, model):
+        self.model = model
+
+    def encode(self, mel):
+        return self.model.embed_audio(mel)
+
+    def decode(self, audio_features, options):
+        if audio_features.shape[1] == self.model.dims.n_audio_ctx:
+            return whisper.decode(self.model, audio_features, options)
+        return dynamic_encoder.decode(self.model, audio_features, options)
+
+
+def get_backend(model):
+    backend = getattr(model, "backend", None)
+    if backend is None:
+        backend = model.backend = EagerBackend(model)
+    return backend
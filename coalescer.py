@@ -0,0 +1,66 @@
+import numpy as np
+
+# Whisper pads every segment to a 30 s window, so a 1 s "yes, go on" costs as much encoder time
+# as 30 s of speech. pack() puts consecutive short segments into one window, with a stretch of
+# silence between them. Whisper is asked for timestamps, and Pack.split() hands every timed
+# piece of text back to the segment its midpoint falls in.
+
+GAP = 1.0               # seconds of silence between packed segments, a clear place for a timestamp
+TIME_PRECISION = 0.02   # seconds per whisper timestamp token
+
+
+class Pack:
+    def __init__(self, segments, rate, gap=GAP):
+        self.count = len(segments)
+        silence = np.zeros(int(gap * rate), dtype=np.float32)
+        parts, self.spans, position = [], [], 0
+        for i, audio in enumerate(segments):
+            if i > 0:
+                parts.append(silence)
+                position += len(silence)
+            parts.append(audio)
+            self.spans.append((position / rate, (position + len(audio)) / rate))
+            position += len(audio)
+        self.audio = np.concatenate(parts) if len(parts) > 1 else segments[0]
+        self.gap = gap
+
+    def split(self, pieces):
+        # pieces: (start, end, text) in seconds from the start of the pack, one text per segment back
+        texts = [[] for _ in self.spans]
+        for start, end, text in pieces:
+            middle = (start + end) / 2
+            distances = [0.0 if s <= middle <= e else min(abs(middle - s), abs(middle - e)) for s, e in self.spans]
+            texts[int(np.argmin(distances))].append(text.strip())
+        return [" ".join(t for t in parts if t) for parts in texts]
+
+
+def pack(segments, rate, max_window=24.0, gap=GAP):
+    # consecutive segments go in the same pack while the audio plus the gaps fits max_window seconds
+    packs, group, length = [], [], 0.0
+    for audio in segments:
+        duration = len(audio) / rate
+        if group and length + gap + duration > max_window:
+            packs.append(Pack(group, rate, gap))
+            group, length = [], 0.0
+        length += duration + (gap if group else 0.0)
+        group.append(audio)
+    if group:
+        packs.append(Pack(group, rate, gap))
+    return packs
+
+
+def pieces_from_tokens(tokenizer, tokens):
+    # (start, end, text) for the text between whisper's timestamp tokens
+    pieces, current, start = [], [], 0.0
+    for token in tokens:
+        if token >= tokenizer.timestamp_begin:
+            time = (token - tokenizer.timestamp_begin) * TIME_PRECISION
+            if current:
+                pieces.append((start, time, tokenizer.decode(current)))
+                current = []
+            start = time
+        else:
+            current.append(token)
+    if current:
+        pieces.append((start, start, tokenizer.decode(current)))
+    return pieces
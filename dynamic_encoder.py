@@ -0,0 +1,52 @@
+import math
+
+import torch.nn.functional as F
+import whisper
+from whisper.decoding import DecodingTask
+
+# Reduced audio context: instead of padding every clip to 30 s (1500 encoder frames), the mel is
+# cut to the clip length plus a little silence, rounded up to a bucket, and the encoder runs on
+# just that. A 2 s clip with 5 s buckets costs the encoder 250 frames instead of 1500; attention
+# is quadratic in the frames, so it is more than 6x less work. Whisper never saw short contexts
+# in training, so the text gets somewhat worse; Dynamic_context_benchmark.py measures how much.
+
+BUCKET = 5.0    # seconds, the encoder input is rounded up to a multiple of this
+PAD = 1.0       # seconds of silence kept after the clip, so the model hears it end
+
+
+def input_samples(samples, bucket=None):
+    rate = whisper.audio.SAMPLE_RATE
+    bucket = bucket or BUCKET
+    seconds = math.ceil((samples / rate + PAD) / bucket) * bucket
+    return min(int(seconds * rate), whisper.audio.N_SAMPLES)
+
+
+def position_slice(encoder, n_ctx, dtype):
+    # the first n_ctx positional embeddings, one cached copy per bucket and dtype
+    cache = encoder.__dict__.setdefault("position_slices", {})
+    key = (n_ctx, dtype, encoder.positional_embedding.device)
+    if key not in cache:
+        cache[key] = encoder.positional_embedding[:n_ctx].to(dtype).contiguous()
+    return cache[key]
+
+
+def embed_audio(model, mel):
+    # AudioEncoder.forward without the fixed 1500 frame assert
+    encoder = model.encoder
+    x = F.gelu(encoder.conv1(mel))
+    x = F.gelu(encoder.conv2(x))
+    x = x.permute(0, 2, 1)
+    x = x + position_slice(encoder, x.shape[1], x.dtype)
+    for block in encoder.blocks:
+        x = block(x)
+    return encoder.ln_post(x)
+
+
+class EncodedDecodingTask(DecodingTask):
+    # whisper.decode only skips the encoder for full 1500 frame features
+    def _get_audio_features(self, mel):
+        return mel.half() if self.options.fp16 else mel
+
+
+def decode(model, audio_features, options):
+    return EncodedDecodingTask(model, options).run(audio_features)
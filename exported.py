@@ -0,0 +1,203 @@
+import argparse
+import os
+import time
+import warnings
+
+import torch
+import torch.nn.functional as F
+import whisper
+from whisper.decoding import DecodingTask, Inference
+
+from weight_cache import cache_root
+
+# TorchScript backend: the encoder, the cross-attention keys/values and one decoder step are
+# traced once and saved, so the model runs as three graphs instead of module by module in
+# Python. The decoder step takes the self-attention key/value cache as plain tensors and hands
+# back the grown cache, so every token after the prompt costs one position of work. whisper's
+# own DecodingTask still drives the loop (prompt, logit filters, beams), only its Inference is
+# swapped. Export ahead of time with `python exported.py base small`; otherwise the first
+# load exports and later ones read the files.
+
+
+def attend(q, k, v, n_head, mask=None):
+    n_batch, n_ctx, n_state = q.shape
+    q = q.view(n_batch, n_ctx, n_head, -1).transpose(1, 2)
+    k = k.view(n_batch, k.shape[1], n_head, -1).transpose(1, 2)
+    v = v.view(n_batch, v.shape[1], n_head, -1).transpose(1, 2)
+    return F.scaled_dot_product_attention(q, k, v, attn_mask=mask).transpose(1, 2).reshape(n_batch, n_ctx, n_state)
+
+
+class CrossKV(torch.nn.Module):
+    # the cross-attention keys and values of every decoder layer, once per segment
+    def __init__(self, decoder):
+        super().__init__()
+        self.decoder = decoder
+
+    def forward(self, audio_features):
+        keys = [block.cross_attn.key(audio_features) for block in self.decoder.blocks]
+        values = [block.cross_attn.value(audio_features) for block in self.decoder.blocks]
+        return torch.stack(keys), torch.stack(values)
+
+
+class DecoderStep(torch.nn.Module):
+    # TextDecoder.forward with the caches as inputs and outputs:
+    #   tokens (batch, n), positions (n,), mask (n, past + n) additive,
+    #   cross_k/cross_v (layers, batch, audio ctx, state), self_k/self_v (layers, batch, past, state)
+    #   -> logits (batch, n, vocab), self_k/self_v (layers, batch, past + n, state)
+    def __init__(self, decoder):
+        super().__init__()
+        self.decoder = decoder
+        self.n_head = decoder.blocks[0].attn.n_head
+
+    def forward(self, tokens, positions, mask, cross_k, cross_v, self_k, self_v):
+        decoder = self.decoder
+        x = decoder.token_embedding(tokens) + decoder.positional_embedding[positions]
+        x = x.to(cross_k.dtype)
+        new_k, new_v = [], []
+        for i, block in enumerate(decoder.blocks):
+            h = block.attn_ln(x)
+            k = torch.cat([self_k[i], block.attn.key(h)], dim=1)
+            v = torch.cat([self_v[i], block.attn.value(h)], dim=1)
+            new_k.append(k)
+            new_v.append(v)
+            x = x + block.attn.out(attend(block.attn.query(h), k, v, self.n_head, mask))
+            h = block.cross_attn_ln(x)
+            x = x + block.cross_attn.out(attend(block.cross_attn.query(h), cross_k[i], cross_v[i], self.n_head))
+            x = x + block.mlp(block.mlp_ln(x))
+        x = decoder.ln(x)
+        logits = (x @ decoder.token_embedding.weight.to(x.dtype).t()).float()
+        return logits, torch.stack(new_k), torch.stack(new_v)
+
+
+def export_dir(name, device, dtype, download_root=None):
+    root = cache_root(download_root)
+    version = torch.__version__.split("+")[0]
+    precision = "fp16" if dtype == torch.float16 else "fp32"
+    return os.path.join(root, f"{name}-torchscript-{device}-{precision}-torch{version}")
+
+
+def step_inputs(model, dtype, n_batch, n_tokens, past):
+    dims = model.dims
+    device = model.device
+    tokens = torch.zeros(n_batch, n_tokens, dtype=torch.long, device=device)
+    positions = torch.arange(past, past + n_tokens, device=device)
+    mask = causal_mask(positions, past + n_tokens, dtype)
+    cross = torch.zeros(dims.n_text_layer, n_batch, dims.n_audio_ctx, dims.n_text_state, dtype=dtype, device=device)
+    cache = torch.zeros(dims.n_text_layer, n_batch, past, dims.n_text_state, dtype=dtype, device=device)
+    return tokens, positions, mask, cross, cross, cache, cache
+
+
+def causal_mask(positions, n_keys, dtype):
+    keys = torch.arange(n_keys, device=positions.device)
+    return torch.zeros(len(positions), n_keys, dtype=dtype, device=positions.device).masked_fill(
+        keys[None, :] > positions[:, None], float("-inf"))
+
+
+def export(model, path, dtype):
+    # traces the three graphs on the model's device and saves them under path
+    dims = model.dims
+    mel = torch.zeros(1, dims.n_mels, whisper.audio.N_FRAMES, dtype=dtype, device=model.device)
+    features = torch.zeros(1, dims.n_audio_ctx, dims.n_audio_state, dtype=dtype, device=model.device)
+    os.makedirs(path, exist_ok=True)
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter("ignore")     # the tracer warns about the encoder's shape assert
+        graphs = {"encoder": torch.jit.trace(model.encoder, mel),
+                  "cross_kv": torch.jit.trace(CrossKV(model.decoder), features),
+                  "decoder_step": torch.jit.trace(DecoderStep(model.decoder), step_inputs(model, dtype, 2, 3, 2))}
+    for name, graph in graphs.items():
+        graph.save(os.path.join(path, f"{name}.pt.part"))
+        os.replace(os.path.join(path, f"{name}.pt.part"), os.path.join(path, f"{name}.pt"))
+    return graphs
+
+
+class ExportedInference(Inference):
+    # whisper's PyTorchInference keeps the cache in forward hooks, here it is two tensors
+    def __init__(self, backend):
+        self.backend = backend
+        self.cleanup_caching()
+
+    def logits(self, tokens, audio_features):
+        if self.self_k is None:
+            self.cross_k, self.cross_v = self.backend.cross_kv(audio_features)
+            if len(tokens) > len(audio_features):   # beam search: n_group token rows per segment
+                group = len(tokens) // len(audio_features)
+                self.cross_k = self.cross_k.repeat_interleave(group, dim=1)
+                self.cross_v = self.cross_v.repeat_interleave(group, dim=1)
+            dims = self.backend.model.dims
+            self.self_k = self.self_v = audio_features.new_zeros(dims.n_text_layer, len(tokens), 0, dims.n_text_state)
+        past = self.self_k.shape[2]
+        tokens = tokens[:, past:]
+        positions = torch.arange(past, past + tokens.shape[1], device=tokens.device)
+        mask = causal_mask(positions, past + tokens.shape[1], audio_features.dtype)
+        logits, self.self_k, self.self_v = self.backend.decoder_step(tokens, positions, mask, self.cross_k, self.cross_v,
+                                                                     self.self_k, self.self_v)
+        return logits
+
+    def rearrange_kv_cache(self, source_indices):
+        if source_indices != list(range(len(source_indices))):
+            self.self_k = self.self_k[:, source_indices]
+            self.self_v = self.self_v[:, source_indices]
+
+    def cleanup_caching(self):
+        self.cross_k = self.cross_v = self.self_k = self.self_v = None
+
+
+class ExportedDecodingTask(DecodingTask):
+    def __init__(self, model, options, backend):
+        super().__init__(model, options)
+        self.backend = backend
+        self.inference = ExportedInference(backend)
+        if hasattr(self.decoder, "inference"):     # the beam search decoder keeps its own reference
+            self.decoder.inference = self.inference
+
+    def _get_audio_features(self, mel):
+        # always given encoded features, of any length (dynamic_encoder.py)
+        return mel.to(self.backend.dtype)
+
+
+class TorchScriptBackend:
+    name = "torchscript"
+
+    def __init__(self, model, graphs, dtype):
+        self.model = model
+        self.dtype = dtype
+        self.encoder = graphs["encoder"]
+        self.cross_kv = graphs["cross_kv"]
+        self.decoder_step = graphs["decoder_step"]
+
+    def encode(self, mel):
+        return self.encoder(mel.to(self.dtype))
+
+    def decode(self, audio_features, options):
+        return ExportedDecodingTask(self.model, options, self).run(audio_features)
+
+
+def load_model(name, device=None, download_root=None):
+    from model_loader import load_model as load_eager
+
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    model = load_eager(name, device=device)
+    dtype = torch.float16 if model.device.type == "cuda" else torch.float32
+    path = export_dir(name, model.device.type, dtype, download_root)
+    graphs = None
+    if all(os.path.exists(os.path.join(path, f"{graph}.pt")) for graph in ("encoder", "cross_kv", "decoder_step")):
+        try:
+            graphs = {graph: torch.jit.load(os.path.join(path, f"{graph}.pt"), map_location=model.device)
+                      for graph in ("encoder", "cross_kv", "decoder_step")}
+        except Exception as e:
+            print(f"Ignoring the exported model in {path}: {e}")
+    if graphs is None:
+        started = time.time()
+        graphs = export(model, path, dtype)
+        print(f"Exported {name} to TorchScript in {time.time() - started:.1f} s, cached in {path}")
+    model.backend = TorchScriptBackend(model, graphs, dtype)
+    return model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export whisper models for the TorchScript backend")
+    parser.add_argument("models", nargs="+", help="e.g. tiny base small")
+    parser.add_argument("--device", default=None, help="cuda or cpu, the graphs only run where they were traced")
+    args = parser.parse_args()
+    for model_name in args.models:
+        load_model(model_name, device=args.device)
@@ -0,0 +1,114 @@
+import importlib.util
+import os
+
+import numpy as np
+
+# Incremental log-mel features. whisper.log_mel_spectrogram runs the STFT of the whole 30 s
+# window after the segment is closed, right when the speaker is waiting for the text. Here the
+# STFT frames are computed as the chunks come in (LogMelBuffer, fed by the Segmenter), and a
+# closed segment only needs its first and last few frames, the ones whisper computes from its
+# reflect and zero padding, plus the final scaling (log_mel). numpy only, the capture side
+# starts without torch.
+
+SAMPLE_RATE = 16000
+N_FFT = 400
+HOP = 160
+N_SAMPLES = 30 * SAMPLE_RATE
+SILENCE = -10.0         # log10 of the 1e-10 floor, what a frame of zeros comes out as
+WINDOW = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(N_FFT) / N_FFT)).astype(np.float32)  # torch.hann_window
+
+_filters = {}
+
+
+def mel_filters(n_mels=80):
+    # whisper's own filterbank, read from its package without importing it
+    if n_mels not in _filters:
+        package = importlib.util.find_spec("whisper").submodule_search_locations[0]
+        with np.load(os.path.join(package, "assets", "mel_filters.npz")) as f:
+            _filters[n_mels] = f[f"mel_{n_mels}"].astype(np.float32)
+    return _filters[n_mels]
+
+
+def raw_frames(audio, first, count, n_mels=80):
+    # log10 mel of `count` frames, frame t covering audio[(first + t) * HOP:][:N_FFT]
+    if count <= 0:
+        return np.zeros((0, n_mels), dtype=np.float32)
+    audio = audio[first * HOP:(first + count - 1) * HOP + N_FFT]
+    windows = np.lib.stride_tricks.sliding_window_view(audio, N_FFT)[::HOP]
+    power = np.abs(np.fft.rfft(windows * WINDOW, axis=-1)) ** 2
+    return np.log10(np.maximum(power.astype(np.float32) @ mel_filters(n_mels).T, 1e-10))
+
+
+class LogMelBuffer:
+    # Rolling buffer of raw log10 mel frames over a 16 kHz float32 stream. Frame f is centred on
+    # stream sample f * HOP, like whisper's frames are on the segment's samples, and is computed
+    # as soon as the audio under its window has arrived. The last `capacity` frames are kept.
+
+    def __init__(self, capacity, n_mels=80):
+        self.n_mels = n_mels
+        self.capacity = capacity
+        self.ring = np.zeros((capacity, n_mels), dtype=np.float32)
+        # frames 0 and 1 reach back before the stream (whisper reflects there), they are never
+        # used, so the first frame is 2 and the audio before its window is skipped
+        self.frames = 2                         # next frame to compute
+        self.skip = 2 * HOP - N_FFT // 2
+        self.tail = np.zeros(0, dtype=np.float32)   # the audio from that frame's window on
+
+    def push(self, audio):
+        if self.skip:
+            n = min(self.skip, len(audio))
+            audio, self.skip = audio[n:], self.skip - n
+        self.tail = np.concatenate([self.tail, audio])
+        if len(self.tail) < N_FFT:
+            return
+        count = (len(self.tail) - N_FFT) // HOP + 1
+        frames = raw_frames(self.tail, 0, count, self.n_mels)
+        i = self.frames % self.capacity
+        n = min(count, self.capacity - i)
+        self.ring[i:i + n] = frames[:n]
+        self.ring[:count - n] = frames[n:]
+        self.frames += count
+        self.tail = self.tail[count * HOP:]
+
+    def read(self, first, last):
+        # copy of frames first..last, None when they are not all in the ring (any more)
+        if first < max(self.frames - self.capacity, 0) or last > self.frames or last <= first:
+            return None
+        i, j = first % self.capacity, last % self.capacity
+        if i < j:
+            return self.ring[i:j].copy()
+        return np.concatenate((self.ring[i:], self.ring[:j]))
+
+
+def log_mel(audio, frames=None, length=N_SAMPLES, n_mels=80):
+    # whisper.log_mel_spectrogram(whisper.pad_or_trim(audio, length), n_mels) as a numpy array.
+    # frames: the raw log10 frames of this audio from a LogMelBuffer (frame 0 centred on
+    # audio[0]); the ones whose window lies inside the audio are used as they are, only the
+    # edges are computed here.
+    n = length // HOP
+    audio = audio[:length]
+    size = len(audio)
+    log_spec = np.full((n, n_mels), SILENCE, dtype=np.float32)
+
+    inside = range(2, min((size - N_FFT // 2) // HOP + 1, n))   # windows fully within the audio
+    if frames is not None and len(inside) and len(frames) >= inside.stop:
+        log_spec[inside.start:inside.stop] = frames[inside.start:inside.stop]
+        todo = [range(0, 2), range(inside.stop, n)]
+    else:
+        todo = [range(0, n)]
+
+    # what whisper's STFT sees: the audio, zeros up to `length`, reflected by half a window at both ends
+    padded = np.zeros(length + N_FFT, dtype=np.float32)
+    padded[N_FFT // 2:N_FFT // 2 + size] = audio
+    padded[:N_FFT // 2] = padded[N_FFT:N_FFT // 2:-1]
+    padded[-N_FFT // 2:] = padded[-N_FFT // 2 - 2:-N_FFT - 2:-1]
+    for frame_range in todo:
+        # frames whose window only sees zeros are SILENCE already
+        stop = min(frame_range.stop, (size + N_FFT // 2) // HOP + 1)
+        if frame_range.stop == n:
+            tail = max(stop, n - 2)
+            log_spec[tail:n] = raw_frames(padded, tail, n - tail, n_mels)
+        log_spec[frame_range.start:stop] = raw_frames(padded, frame_range.start, stop - frame_range.start, n_mels)
+
+    log_spec = np.maximum(log_spec, log_spec.max() - 8.0)
+    return ((log_spec + 4.0) / 4.0).T
@@ -0,0 +1,109 @@
+import time
+
+import metrics
+
+
+def language_probs(model, audio_features):
+    # whisper.detect_language, for encoder output of any length (it re-runs the encoder on
+    # anything that isn't 1500 frames long)
+    import torch
+    from whisper.tokenizer import get_tokenizer
+
+    tokenizer = get_tokenizer(model.is_multilingual, num_languages=model.num_languages)
+    tokens = torch.tensor([[tokenizer.sot]] * audio_features.shape[0]).to(audio_features.device)
+    logits = model.logits(tokens, audio_features)[:, 0]
+    language_tokens = list(tokenizer.all_language_tokens)
+    probs = logits[:, language_tokens].float().softmax(dim=-1).cpu()
+    return [dict(zip(tokenizer.all_language_codes, row.tolist())) for row in probs]
+
+
+class LanguageController:
+    # "auto" language that sticks. Whisper detects the language of every segment on its own,
+    # which costs a decoder pass (an encoder pass too for the ones that go through
+    # model.transcribe) and lets a short "okay" flip the language. This keeps a score per
+    # language, a duration weighted average of the detections, and only detects again when
+    #
+    #   - `redetect_every` seconds of audio went by since the last detection,
+    #   - the confidence, halved every `half_life` seconds of audio, dropped below `min_confidence`,
+    #   - or a segment decoded badly (avg_logprob under `min_logprob`), which is what a wrong
+    #     language looks like.
+
+    def __init__(self, redetect_every=60.0, half_life=120.0, min_confidence=0.5, min_logprob=-1.0,
+                 full_weight=10.0):
+        self.redetect_every = redetect_every
+        self.half_life = half_life
+        self.min_confidence = min_confidence
+        self.min_logprob = min_logprob
+        self.full_weight = full_weight  # seconds, shorter segments move the scores less
+        self.language = None
+        self.scores = {}
+        self.confidence = 0.0
+        self.since_detection = 0.0      # seconds of audio
+        self.redetect = True
+
+        self.detections = 0
+        self.detection_time = 0.0
+        self.detected_segments = 0
+        self.skipped_segments = 0
+        self.audio_seconds = 0.0
+        metrics.set_gauge("language_detection_saved_per_hour", self.saved_per_hour)
+
+    def current_confidence(self):
+        return self.confidence * 0.5 ** (self.since_detection / self.half_life)
+
+    def needs_detection(self):
+        return (self.language is None or self.redetect or self.since_detection >= self.redetect_every
+                or self.current_confidence() < self.min_confidence)
+
+    def detect(self, model, audio_features, durations):
+        if not model.is_multilingual:
+            self.language, self.confidence, self.redetect = "en", 1.0, False
+            return
+        started = time.perf_counter()
+        probs = language_probs(model, audio_features)
+        seconds = time.perf_counter() - started
+        metrics.observe("language_detection", seconds)
+        self.detections += 1
+        self.detection_time += seconds
+        self.detected_segments += len(durations)
+        self.update(probs, durations)
+
+    def update(self, probs, durations):
+        for segment_probs, duration in zip(probs, durations):
+            weight = min(1.0, duration / self.full_weight)
+            if not self.scores:
+                self.scores = dict(segment_probs)
+                continue
+            for language in self.scores.keys() | segment_probs.keys():
+                self.scores[language] = (1 - weight) * self.scores.get(language, 0.0) + weight * segment_probs.get(language, 0.0)
+        language = max(self.scores, key=self.scores.get)
+        if language != self.language:
+            if self.language is not None:
+                metrics.inc("language_switches")
+            metrics.log("language", language=language, confidence=round(self.scores[language], 3))
+        self.language = language
+        self.confidence = self.scores[language]
+        self.since_detection = 0.0
+        self.redetect = False
+
+    def observe(self, results, durations, detected):
+        # after decoding: count the audio, and ask for a new detection when the text looks wrong
+        for result, duration in zip(results, durations):
+            self.audio_seconds += duration
+            self.since_detection += duration
+            if result.avg_logprob < self.min_logprob and result.no_speech_prob < 0.6:
+                self.redetect = True
+        if not detected:
+            self.skipped_segments += len(durations)
+            metrics.inc("language_detections_skipped", len(durations))
+
+    def saved_per_hour(self):
+        # detection time the skipped segments would have cost, per hour of audio
+        if not self.detected_segments or not self.audio_seconds:
+            return 0.0
+        per_segment = self.detection_time / self.detected_segments
+        return per_segment * self.skipped_segments / (self.audio_seconds / 3600)
+
+    def report(self):
+        return (f"Language {self.language} ({self.current_confidence():.2f}), {self.detections} detections, "
+                f"{self.skipped_segments} segments without one, {self.saved_per_hour():.1f} s saved per hour of audio")
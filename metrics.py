@@ -0,0 +1,190 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Counters, gauges and timing spans for the capture -> queue -> model -> output path.
+#
+#   metrics.inc("segments")                      counter
+#   metrics.set_gauge("queue_depth", q.qsize)    gauge, a value or a function read when scraped
+#   with metrics.span("encoder"): ...            timing span (or metrics.observe(name, seconds))
+#   with metrics.span("encoder", sync=True): ... the same, waits for the GPU (registry.sync) before closing
+#   metrics.log("segment", latency=0.8)          one JSON line in the log file, if one is open
+#
+# Spans keep a count, a total and the last `window` values for the percentiles. Everything is
+# cheap enough to stay on all the time; serve() and open_log() only decide where it shows up.
+
+
+class Metrics:
+    def __init__(self, window=1000):
+        self.window = window
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.spans = {}             # name -> [count, total, recent values]
+        self.log_file = None
+        self.sync = None            # called before a span(sync=True) is closed, e.g. torch.cuda.synchronize
+        self.profiler = None
+
+    def inc(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name, value):
+        self.gauges[name] = value
+
+    def observe(self, name, seconds):
+        with self.lock:
+            span = self.spans.get(name)
+            if span is None:
+                span = self.spans[name] = [0, 0.0, deque(maxlen=self.window)]
+            span[0] += 1
+            span[1] += seconds
+            span[2].append(seconds)
+
+    @contextmanager
+    def span(self, name, sync=False):
+        # sync=True only for model work; other threads (capture, output) must not wait on the GPU
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            if sync and self.sync is not None:
+                self.sync()
+            self.observe(name, time.perf_counter() - started)
+
+    def total(self, name):
+        span = self.spans.get(name)
+        return span[1] if span is not None else 0.0
+
+    def snapshot(self):
+        gauges = {}
+        for name, value in list(self.gauges.items()):
+            try:
+                gauges[name] = value() if callable(value) else value
+            except Exception:
+                gauges[name] = None
+        with self.lock:
+            spans = {}
+            for name, (count, total, recent) in self.spans.items():
+                values = sorted(recent)
+                spans[name] = {"count": count, "sum": total,
+                               "p50": values[len(values) // 2],
+                               "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+                               "max": values[-1]}
+            return {"uptime": time.time() - self.started, "counters": dict(self.counters),
+                    "gauges": gauges, "spans": spans}
+
+    def prometheus(self):
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in snapshot["counters"].items():
+            lines += [f"# TYPE whisper_{name}_total counter", f"whisper_{name}_total {value}"]
+        for name, value in snapshot["gauges"].items():
+            if value is not None:
+                lines += [f"# TYPE whisper_{name} gauge", f"whisper_{name} {value}"]
+        for name, span in snapshot["spans"].items():
+            lines.append(f"# TYPE whisper_{name}_seconds summary")
+            lines.append(f'whisper_{name}_seconds{{quantile="0.5"}} {span["p50"]}')
+            lines.append(f'whisper_{name}_seconds{{quantile="0.95"}} {span["p95"]}')
+            lines.append(f"whisper_{name}_seconds_sum {span['sum']}")
+            lines.append(f"whisper_{name}_seconds_count {span['count']}")
+        return "\n".join(lines) + "\n"
+
+    def open_log(self, path):
+        self.log_file = sys.stderr if path == "-" else open(path, "a", encoding="utf-8")
+
+    def log(self, event, **fields):
+        if self.log_file is None:
+            return
+        line = json.dumps(dict(time=round(time.time(), 3), event=event, **fields), ensure_ascii=False, default=str)
+        with self.lock:
+            self.log_file.write(line + "\n")
+            self.log_file.flush()
+
+    def serve(self, port, host="127.0.0.1"):
+        # /metrics (Prometheus text), /metrics.json and /profile (collapsed stacks, when profiling)
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, kind = registry.prometheus(), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, kind = json.dumps(registry.snapshot()), "application/json"
+                elif self.path == "/profile" and registry.profiler is not None:
+                    body, kind = registry.profiler.collapsed(), "text/plain"
+                else:
+                    self.send_error(404)
+                    return
+                data = body.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", kind)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def profile_thread(self, thread_id=None, interval=0.005):
+        self.profiler = SamplingProfiler(thread_id or threading.get_ident(), interval)
+        self.profiler.start()
+        return self.profiler
+
+
+class SamplingProfiler:
+    # Looks at the stack of one thread every `interval` seconds from a daemon thread and counts
+    # the stacks it sees. collapsed() gives them in the "a;b;c count" format flame graph tools read.
+
+    def __init__(self, thread_id, interval=0.005, depth=30):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.depth = depth
+        self.stacks = Counter()
+        self.samples = 0
+        self.running = False
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        while self.running:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                stack = []
+                while frame is not None and len(stack) < self.depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+            time.sleep(self.interval)
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+registry = Metrics()
+inc = registry.inc
+set_gauge = registry.set_gauge
+observe = registry.observe
+span = registry.span
+log = registry.log
+serve = registry.serve
+open_log = registry.open_log
+profile_thread = registry.profile_thread
+snapshot = registry.snapshot
@@ -0,0 +1,63 @@
+import threading
+import time
+
+
+def load_model(name, device=None):
+    # "<size>" is whisper's own model (mapped from the weight cache, weight_cache.py), "<size>-int8"
+    # the quantized CPU backend (quantized.py), "<size>-jit" the TorchScript backend (exported.py)
+    if name.endswith("-jit"):
+        import exported
+        return exported.load_model(name[:-len("-jit")], device=device)
+    if name.endswith("-int8"):
+        import quantized
+        return quantized.load_model(name[:-len("-int8")])
+    import weight_cache
+    return weight_cache.load_model(name, device=device)
+
+
+class BackgroundModel:
+    # Loads a whisper model on a thread so it overlaps the microphone / threshold / language
+    # menus. torch and whisper are only imported on that thread, the program itself starts
+    # without them. A short warm-up pass runs before the model is handed out, so the first
+    # real segment doesn't pay for first-call setup.
+
+    def __init__(self, name, device=None, launched=None, warm_up=True):
+        self.name = name
+        self.device = device
+        self.warm_up = warm_up
+        self.launched = launched or time.time()
+        self.model = None
+        self.error = None
+        self.load_time = None       # seconds spent in imports + load + warm-up
+        self.time_to_ready = None   # seconds from program launch until the model was ready
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.load, daemon=True)
+        self.thread.start()
+
+    def load(self):
+        started = time.time()
+        try:
+            import transcriber
+
+            model = load_model(self.name, device=self.device)
+            if self.warm_up:
+                transcriber.warm_up(model)
+            self.model = model
+        except Exception as e:
+            self.error = e
+        finally:
+            now = time.time()
+            self.load_time = now - started
+            self.time_to_ready = now - self.launched
+            self.ready.set()
+
+    def get(self):
+        if not self.ready.is_set():
+            print(f"Loading the {self.name} model, almost there...")
+        self.ready.wait()
+        if self.error is not None:
+            raise self.error
+        return self.model
+
+    def report(self):
+        return f"Model {self.name} ready {self.time_to_ready:.1f} s after launch (load {self.load_time:.1f} s)"
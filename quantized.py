@@ -0,0 +1,48 @@
+import os
+import time
+import warnings
+
+import torch
+import whisper
+
+from weight_cache import cache_root
+
+# int8 CPU backend: dynamic quantization of every Linear layer (attention and MLP weights, the
+# bulk of the compute), activations stay float and are quantized on the fly. The quantized
+# model is saved whole next to whisper's own downloads, so only the first start pays for it, and
+# later starts map its weights the way weight_cache.py does.
+
+
+def cache_path(name, download_root=None):
+    root = cache_root(download_root)
+    torch_version = torch.__version__.split("+")[0]
+    return os.path.join(root, f"{name}-int8-whisper{whisper.__version__}-torch{torch_version}.pt")
+
+
+def quantize(model):
+    # quantize_dynamic only picks up modules that are exactly nn.Linear, whisper's subclass only
+    # adds a dtype cast that does nothing on CPU
+    for module in model.modules():
+        if type(module) is whisper.model.Linear:
+            module.__class__ = torch.nn.Linear
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")     # torch points to torchao for new code
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_model(name, download_root=None):
+    path = cache_path(name, download_root)
+    if os.path.exists(path):
+        try:
+            return torch.load(path, map_location="cpu", weights_only=False, mmap=True).eval()
+        except Exception as e:
+            print(f"Ignoring the quantized model cache {path}: {e}")
+
+    started = time.time()
+    model = quantize(whisper.load_model(name, device="cpu")).eval()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    part = f"{path}.{os.getpid()}.part"     # workers starting together each write their own
+    torch.save(model, part)
+    os.replace(part, path)
+    print(f"Quantized {name} to int8 in {time.time() - started:.1f} s, cached in {path}")
+    return model
@@ -0,0 +1,59 @@
+from math import gcd
+
+import numpy as np
+
+
+class Resampler:
+    # Streaming polyphase resampler (windowed-sinc, Kaiser window) for any pair of integer
+    # rates. Feed it chunks as they come off the microphone, the filter state is carried
+    # over between calls so chunk borders don't click.
+
+    def __init__(self, orig_rate, target_rate, taps=64, rolloff=0.92, beta=8.0):
+        g = gcd(int(orig_rate), int(target_rate))
+        self.orig_rate = int(orig_rate)
+        self.target_rate = int(target_rate)
+        self.up = self.target_rate // g
+        self.down = self.orig_rate // g
+        self.taps = taps    # input samples each output sample looks at
+
+        # prototype low-pass at the upsampled rate, cut below the lower of the two Nyquists
+        length = taps * self.up
+        cutoff = rolloff * 0.5 / max(self.up, self.down)
+        n = np.arange(length) - (length - 1) / 2
+        h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, beta) * self.up
+        # phase p uses h[p], h[p + up], h[p + 2 up], ... against x[i], x[i - 1], x[i - 2], ...
+        self.phases = h.reshape(taps, self.up).T.astype(np.float32)
+
+        self.offsets = np.arange(taps)
+        self.reset()
+
+    def reset(self):
+        self.history = np.zeros(self.taps - 1, dtype=np.float32)
+        self.consumed = 0       # input samples seen so far
+        self.produced = 0       # output samples produced so far
+
+    def process(self, chunk):
+        chunk = np.asarray(chunk, dtype=np.float32)
+        if self.up == self.down:
+            return chunk
+        buffer = np.concatenate([self.history, chunk])
+        buffer_start = self.consumed - len(self.history)
+        self.consumed += len(chunk)
+
+        # every output sample whose newest input sample has arrived
+        last = (self.consumed * self.up - 1) // self.down
+        n = np.arange(self.produced, last + 1)
+        self.produced = last + 1
+        self.history = buffer[len(buffer) - (self.taps - 1):]
+        if len(n) == 0:
+            return np.zeros(0, dtype=np.float32)
+
+        t = n * self.down
+        index = t // self.up - buffer_start
+        windows = buffer[index[:, np.newaxis] - self.offsets]
+        return np.einsum("ij,ij->i", windows, self.phases[t % self.up])
+
+
+def resample(audio, orig_rate, target_rate):
+    # one-shot version for whole recordings
+    return Resampler(orig_rate, target_rate).process(audio)
@@ -0,0 +1,176 @@
+import queue
+import time
+from collections import deque
+
+import metrics
+from segmenter import END_OF_SOURCE, merge_segments
+
+MAX_MERGED = 28.0   # seconds, merged segments have to fit one 30 s mel window (gaps included)
+
+
+class LatencyScheduler:
+    # Sits between audio_queue and the model and keeps the captions within `budget` seconds of
+    # the speech. Everything queued is taken into a backlog, and the time until the last segment
+    # would come out is estimated from the measured seconds per segment of the current model
+    # (whisper pads every segment to 30 s, so the cost hardly depends on its length). When that
+    # goes over the budget, in this order:
+    #
+    #   1. switch to the preloaded fallback model (e.g. tiny instead of base), if there is one
+    #   2. "coalesce": merge neighbouring segments, so the backlog takes fewer model calls
+    #   3. drop the oldest segments until the rest fits ("drop", and "coalesce" when merging
+    #      was not enough). "keep" never drops anything.
+    #
+    # It switches back to the main model once nothing has piled up for `recover_time` seconds and
+    # the work done in that time would have kept the main model less than 80 % busy.
+    # Every decision is counted in self.counters and in metrics as scheduler_<decision>.
+
+    def __init__(self, model_loader, fallback_loader=None, budget=3.0, policy="coalesce", recover_time=10.0,
+                 cost=None):
+        if policy not in ("coalesce", "drop", "keep"):
+            raise ValueError(f"Unknown overload policy: {policy}")
+        self.loaders = {"main": model_loader, "fallback": fallback_loader}
+        self.budget = budget
+        self.policy = policy
+        self.recover_time = recover_time
+        self.cost = {"main": cost, "fallback": None}  # measured seconds per segment, None until known
+        self.current = "main"
+        self.backlog = deque()
+        self.ended = False          # END_OF_SOURCE was taken, nothing more will come
+        self.last_busy = time.time()
+        self.work = deque()         # (done at, model seconds, model) of the last recover_time seconds
+        self.counters = {"downgrades": 0, "upgrades": 0, "coalesced": 0, "dropped": 0, "dropped_seconds": 0.0}
+        metrics.set_gauge("scheduler_fallback_active", lambda: int(self.current == "fallback"))
+        metrics.set_gauge("scheduler_backlog", lambda: len(self.backlog))
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+        metrics.inc(f"scheduler_{name}", amount)
+
+    def fallback_ready(self):
+        loader = self.loaders["fallback"]
+        return loader is not None and loader.ready.is_set() and loader.error is None
+
+    def main_load(self):
+        # the recent work, converted to main model time, as a share of the wall clock
+        now = time.time()
+        while self.work and self.work[0][0] < now - self.recover_time:
+            self.work.popleft()
+        main_cost = self.cost["main"]
+        if main_cost is None:
+            return 0.0
+        busy = sum(seconds * main_cost / self.cost[name] for _, seconds, name in self.work)
+        return busy / self.recover_time
+
+    def projected_latency(self, model_name, segments=None):
+        # how late the last of `segments` (default: the backlog) would come out with this model
+        segments = self.backlog if segments is None else segments
+        cost = self.cost[model_name]
+        if not segments or cost is None:
+            return 0.0
+        return time.time() + cost * len(segments) - min(s.speech_end_at for s in segments)
+
+    def coalesce(self):
+        merged, group = deque(), []
+        for segment in self.backlog:
+            if group and sum(s.duration for s in group) + segment.duration + 0.1 * len(group) > MAX_MERGED:
+                merged.append(merge_segments(group) if len(group) > 1 else group[0])
+                group = []
+            group.append(segment)
+        if group:
+            merged.append(merge_segments(group) if len(group) > 1 else group[0])
+        self.count("coalesced", len(self.backlog) - len(merged))
+        self.backlog = merged
+
+    def drop_stale(self):
+        # the newest segment is always kept, it is the one people are waiting for
+        while len(self.backlog) > 1 and self.projected_latency(self.current) > self.budget:
+            segment = self.backlog.popleft()
+            self.count("dropped")
+            self.count("dropped_seconds", segment.duration)
+            metrics.log("scheduler_drop", start=round(segment.start, 3), duration=round(segment.duration, 3))
+
+    def plan(self):
+        if self.projected_latency(self.current) <= self.budget:
+            return
+        self.last_busy = time.time()
+        if self.current == "main" and self.fallback_ready():
+            self.current = "fallback"
+            self.count("downgrades")
+            metrics.log("scheduler_downgrade", backlog=len(self.backlog))
+            if self.projected_latency(self.current) <= self.budget:
+                return
+        if self.policy == "coalesce" and len(self.backlog) > 1:
+            self.coalesce()
+        if self.policy != "keep":
+            self.drop_stale()
+
+    def add(self, items):
+        for item in items:
+            if item is END_OF_SOURCE:
+                self.ended = True
+            else:
+                self.backlog.append(item)
+
+    def take(self, audio_queue, max_batch, max_wait=0.0):
+        # returns (model, batch); blocks while there is nothing to do. The batch is empty once the
+        # source ended and the backlog is done.
+        if not self.backlog and not self.ended:
+            import transcriber
+            self.add(transcriber.collect_batch(audio_queue, max_batch, max_wait))
+        while not self.ended:
+            try:
+                self.add([audio_queue.get_nowait()])
+            except queue.Empty:
+                break
+        if len(self.backlog) > 1:
+            self.last_busy = time.time()
+        elif (self.current == "fallback" and time.time() - self.last_busy > self.recover_time
+              and self.main_load() < 0.8):
+            self.current = "main"
+            self.count("upgrades")
+            metrics.log("scheduler_upgrade")
+        self.plan()
+        batch = [self.backlog.popleft() for _ in range(min(max_batch, len(self.backlog)))]
+        return self.loaders[self.current].get(), batch
+
+    def done(self, batch):
+        # feed back how long the model took, from the segments' model_time
+        seconds = sum(segment.model_time for segment in batch)
+        self.work.append((time.time(), seconds, self.current))
+        cost = seconds / len(batch)
+        previous = self.cost[self.current]
+        self.cost[self.current] = cost if previous is None else 0.7 * previous + 0.3 * cost
+
+
+class FairQueue(queue.Queue):
+    # A queue over several audio streams (server mode): get() takes one segment from each stream
+    # in turn, so a room that talks a lot cannot hold the others up. Items are grouped by their
+    # `stream` attribute; the order within a stream is kept. collect_batch works on it as on a
+    # plain queue.Queue.
+
+    def _init(self, maxsize):
+        self.turns = deque()        # the streams with something queued, in turn order
+        self.streams = {}           # stream -> deque of its segments
+        self.count = 0
+
+    def _qsize(self):
+        return self.count
+
+    def _put(self, item):
+        key = getattr(item, "stream", None)
+        if key not in self.streams:
+            self.streams[key] = deque()
+            self.turns.append(key)
+        self.streams[key].append(item)
+        self.count += 1
+
+    def _get(self):
+        key = self.turns.popleft()
+        items = self.streams[key]
+        item = items.popleft()
+        if items:
+            self.turns.append(key)  # back of the line
+        else:
+            del self.streams[key]
+        self.count -= 1
+        return item
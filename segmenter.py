@@ -0,0 +1,201 @@
+import time
+
+import numpy as np
+
+from features import HOP, N_FFT, LogMelBuffer
+
+END_OF_SOURCE = object()    # put on the queue after the last segment of a source that ended (file, pipe, socket)
+
+
+class Segment:
+    def __init__(self, audio, rate, start, speech_frames, speech_end_at=None):
+        self.audio = audio                  # whatever the segmenter's convert step makes of the chunks
+        self.rate = rate
+        self.start = start                  # seconds since the stream started
+        self.end = start + len(audio) / rate
+        self.speech_frames = speech_frames
+
+        # wall clock times along the pipeline, for latency measurements
+        self.closed_at = time.time()
+        self.speech_end_at = speech_end_at or self.closed_at  # when the last speech chunk came in
+        self.queued_at = None
+        self.dequeued_at = None
+        self.done_at = None
+        self.model_time = None              # this segment's share of the model time of its batch
+        self.mel_frames = None              # log-mel frames computed during capture (features.py)
+
+    @property
+    def duration(self):
+        return len(self.audio) / self.rate
+
+    def timings(self):
+        # seconds spent in every step, for the JSON log
+        def between(a, b):
+            return round(b - a, 4) if a is not None and b is not None else None
+        return {"start": round(self.start, 3), "duration": round(self.duration, 3),
+                "segment_close": between(self.speech_end_at, self.closed_at),
+                "queue_wait": between(self.queued_at, self.dequeued_at),
+                "model_time": round(self.model_time, 4) if self.model_time is not None else None,
+                "latency": between(self.speech_end_at, self.done_at)}
+
+
+class Segmenter:
+    # The silence logic of record_audio: a segment starts on the first speech chunk and is
+    # closed after silence_time seconds without speech. Chunks go in one by one with push(),
+    # or a whole recording at once with push_many(). The VAD looks at the raw chunks, while
+    # the segment keeps them after convert (e.g. float32 resampled to 16 kHz), done as each
+    # chunk arrives so the segment is ready for the model as soon as it is closed.
+    #
+    # The converted audio goes into one ring buffer, allocated once, so a long session does not
+    # allocate per chunk. A segment is a single copy out of the ring, reaching pre_roll seconds
+    # back before the first speech chunk and post_roll seconds past the last one (None keeps the
+    # whole silence_time tail). Segments are closed at max_segment_time, whisper only looks at 30 s.
+    # With mel=True (16 kHz float32 output only) the log-mel frames are computed as the audio
+    # comes in and handed over with the segment, so the model does not have to run the STFT.
+
+    def __init__(self, vad, rate, chunk, silence_time=0.8, min_speech_time=0.0, pre_roll=0.0,
+                 convert=None, output_rate=None, post_roll=None, max_segment_time=30.0, mel=False):
+        self.vad = vad
+        self.rate = rate
+        self.chunk = chunk
+        self.convert = convert
+        self.output_rate = output_rate or rate
+        self.silence_chunks = silence_time * rate / chunk
+        self.min_speech_chunks = int(min_speech_time * rate / chunk)
+        # the VAD only reports speech after min_speech chunks, keep those so the onset is not lost
+        chunk_out = int(np.ceil(chunk * self.output_rate / rate)) + 1
+        self.pre_roll = max(int(pre_roll * self.output_rate), (vad.min_speech - 1) * chunk * self.output_rate // rate)
+        self.post_roll = int(post_roll * self.output_rate) if post_roll is not None else None
+        self.max_samples = int(max_segment_time * self.output_rate)
+        self.capacity = self.max_samples + self.pre_roll + 2 * chunk_out
+        self.ring = None        # allocated on the first chunk, with the dtype convert makes
+        self.mel = LogMelBuffer(self.capacity // HOP + 2) if mel else None
+
+        self.position = 0       # input samples pushed so far
+        self.written = 0        # output samples written to the ring so far
+        self.last_end = 0       # where the last segment ended, the pre-roll does not reach back past it
+        self.dropped = 0        # segments thrown away for having too little speech
+        self.start_new()
+
+    def start_new(self):
+        self.silent_frames = 0
+        self.speech_frames = 0
+        self.speech_end_at = None
+        self.speech_end = 0     # ring position after the last speech chunk
+        self.recording = False
+        self.start = 0          # ring position where the open segment starts
+        self.added = []         # chunks that joined the current segment in the last push
+
+    @property
+    def open_seconds(self):
+        return (self.written - self.start) / self.output_rate if self.recording else 0.0
+
+    def write(self, audio):
+        if self.ring is None:
+            self.ring = np.zeros(self.capacity, dtype=audio.dtype)
+        i = self.written % self.capacity
+        n = min(len(audio), self.capacity - i)
+        self.ring[i:i + n] = audio[:n]
+        self.ring[:len(audio) - n] = audio[n:]
+        self.written += len(audio)
+
+    def read(self, start, end):
+        # one contiguous copy of ring positions start..end
+        i, j = start % self.capacity, end % self.capacity
+        if end - start <= 0:
+            return self.ring[:0].copy()
+        if i < j:
+            return self.ring[i:j].copy()
+        return np.concatenate((self.ring[i:], self.ring[:j]))
+
+    def push(self, audio_data, speech=None):
+        if speech is None:
+            speech = self.vad.process(audio_data[np.newaxis, :])[0]
+        self.added = []
+        samples = len(audio_data)
+        if self.convert is not None:
+            audio_data = self.convert(audio_data)
+        chunk_start = self.written
+        self.write(audio_data)
+        if self.mel is not None:
+            self.mel.push(audio_data)
+        self.position += samples
+
+        if not speech:
+            self.silent_frames += 1
+        else:
+            self.silent_frames = 0
+            self.speech_frames += 1
+            self.speech_end_at = time.time()
+            self.speech_end = self.written
+            if not self.recording:
+                self.recording = True
+                earliest = max(self.last_end, self.written - self.capacity)
+                self.start = max(chunk_start - self.pre_roll, earliest)
+                if self.mel is not None:
+                    # on a frame boundary, so the segment's frames are the stream's frames
+                    self.start -= self.start % HOP
+                    if self.start < earliest:
+                        self.start += HOP
+                if self.start < chunk_start:
+                    self.added.append(self.read(self.start, chunk_start))
+        if self.recording:
+            self.added.append(audio_data)
+
+        if self.recording and (self.silent_frames > self.silence_chunks or
+                               self.written - self.start + len(audio_data) > self.max_samples):
+            return self.close()
+        return None
+
+    def push_many(self, audio, batch=1024):
+        # replay a whole int16 recording, the VAD sees it in batches of chunks
+        n = len(audio) // self.chunk
+        frames = audio[:n * self.chunk].reshape(n, self.chunk)
+        segments = []
+        for i in range(0, n, batch):
+            decisions = self.vad.process(frames[i:i + batch])
+            for frame, speech in zip(frames[i:i + batch], decisions):
+                segment = self.push(frame, speech)
+                if segment is not None:
+                    segments.append(segment)
+        return segments
+
+    def close(self):
+        segment = None
+        end = self.written
+        if self.post_roll is not None:
+            end = min(end, self.speech_end + self.post_roll)
+        if self.speech_frames >= self.min_speech_chunks:
+            segment = Segment(self.read(self.start, end), self.output_rate, self.start / self.output_rate,
+                              self.speech_frames, self.speech_end_at)
+            if self.mel is not None:
+                first = self.start // HOP
+                segment.mel_frames = self.mel.read(first, first + (end - self.start - N_FFT // 2) // HOP + 1)
+        else:
+            self.dropped += 1
+        self.last_end = end
+        self.start_new()
+        return segment
+
+    def flush(self):
+        # end of the stream, close what is still open
+        if self.recording:
+            return self.close()
+        return None
+
+
+def merge_segments(segments, gap=0.1):
+    # one segment out of several, with `gap` seconds of silence between them
+    rate = segments[0].rate
+    silence = np.zeros(int(gap * rate), dtype=segments[0].audio.dtype)
+    parts = []
+    for i, segment in enumerate(segments):
+        if i > 0:
+            parts.append(silence)
+        parts.append(segment.audio)
+    merged = Segment(np.concatenate(parts), rate, segments[0].start, sum(s.speech_frames for s in segments),
+                     segments[-1].speech_end_at)
+    merged.end = segments[-1].end
+    merged.closed_at = segments[-1].closed_at
+    merged.queued_at = segments[0].queued_at
+    return merged
@@ -0,0 +1,64 @@
+import time
+
+import metrics
+
+
+def no_speech_probs(model, audio_features):
+    # whisper's no-speech probability, from one decoder step on the start-of-transcript token
+    # (the decoder is causal, so this is the same number the full decode reports)
+    import torch
+    from whisper.tokenizer import get_tokenizer
+
+    tokenizer = get_tokenizer(model.is_multilingual, num_languages=model.num_languages)
+    tokens = torch.tensor([[tokenizer.sot]] * audio_features.shape[0]).to(audio_features.device)
+    logits = model.logits(tokens, audio_features)[:, 0]
+    return logits.float().softmax(dim=-1)[:, tokenizer.no_speech].tolist()
+
+
+class NoSpeechGate:
+    # Noise that got past the VAD costs a full decode, and whisper tends to write something for
+    # it ("Thank you.", the same phrase over and over). The gate runs after the encoder: one
+    # decoder step per segment, and segments with a no-speech probability above `threshold`
+    # come back as "" without being decoded. The rest are decoded from the same encoder output.
+    # whisper itself also wants a low avg_logprob before it calls a window silent, which needs
+    # the decode, so the threshold here is higher than its 0.6.
+
+    def __init__(self, threshold=0.8):
+        self.threshold = threshold
+        self.checked = 0
+        self.gated = 0
+        self.gated_seconds = 0.0      # audio that was not decoded
+        self.step_time = 0.0          # spent on the gate itself
+        self.decode_time = 0.0        # spent decoding the segments that passed
+        self.decoded = 0
+        metrics.set_gauge("no_speech_gate_saved_seconds", self.saved_seconds)
+
+    def check(self, model, audio_features):
+        # one bool per segment, True to decode it
+        started = time.perf_counter()
+        with metrics.span("no_speech_gate", sync=True):
+            probs = no_speech_probs(model, audio_features)
+        self.step_time += time.perf_counter() - started
+        self.checked += len(probs)
+        metrics.inc("no_speech_checked", len(probs))
+        return [p <= self.threshold for p in probs]
+
+    def rejected(self, duration):
+        self.gated += 1
+        self.gated_seconds += duration
+        metrics.inc("no_speech_gated")
+        metrics.inc("no_speech_gated_seconds", duration)
+
+    def observe(self, decode_seconds, decoded):
+        self.decode_time += decode_seconds
+        self.decoded += decoded
+
+    def saved_seconds(self):
+        # decoder time the gated segments would have taken (at the average seen so far), minus the gate
+        if self.decoded == 0:
+            return 0.0
+        return self.gated * self.decode_time / self.decoded - self.step_time
+
+    def report(self):
+        return (f"No-speech gate: {self.gated} of {self.checked} segments ({self.gated_seconds:.0f} s of audio) "
+                f"not decoded, about {self.saved_seconds():.1f} s of decoding saved")
@@ -0,0 +1,196 @@
+import queue
+import re
+import time
+
+import numpy as np
+
+from segmenter import END_OF_SOURCE
+
+WHISPER_RATE = 16000
+
+
+def normalize_word(word):
+    return re.sub(r"[^\w']", "", word.lower())
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    return float(np.percentile(values, q))
+
+
+class StreamingTranscriber:
+    # Re-transcribes a growing window of the current utterance every `step` seconds.
+    # Words are committed once two consecutive passes agree on them (local agreement),
+    # and the committed audio is cut from the window so every pass costs about the same.
+
+    def __init__(self, model, language, step=0.5, max_window=12.0, on_partial=None, on_commit=None, **transcribe_options):
+        self.model = model
+        self.language = language if language != "auto" else None
+        self.step = step
+        self.max_window = max_window
+        self.on_partial = on_partial or self.print_partial
+        self.on_commit = on_commit or self.print_commit
+        self.transcribe_options = transcribe_options
+
+        self.first_word_latencies = []
+        self.commit_latencies = []
+        self.passes = 0
+        self.reset()
+
+    def reset(self):
+        self.window = np.zeros(0, dtype=np.float32)
+        self.window_offset = 0.0     # time of window[0] since the utterance started
+        self.samples_seen = 0
+        self.arrivals = []           # (samples seen so far, wall clock) per chunk
+        self.pending = 0             # samples received since the last pass
+        self.hypothesis = []         # uncommitted words of the previous pass
+        self.committed = []
+        self.committed_until = 0.0
+        self.utterance_start = None
+        self.first_word_seen = False
+        self.line = ""
+
+    def add_audio(self, audio):
+        now = time.time()
+        if self.utterance_start is None:
+            self.utterance_start = now
+        self.window = np.concatenate([self.window, audio])
+        self.samples_seen += len(audio)
+        self.pending += len(audio)
+        self.arrivals.append((self.samples_seen, now))
+
+    def ready(self):
+        return self.pending >= self.step * WHISPER_RATE
+
+    def captured_at(self, t):
+        # wall clock time at which the audio at utterance time t had arrived
+        sample = int(t * WHISPER_RATE)
+        for samples_seen, arrival in self.arrivals:
+            if samples_seen >= sample:
+                return arrival
+        return self.arrivals[-1][1]
+
+    def transcribe_window(self):
+        prompt = " ".join(w["word"].strip() for w in self.committed[-20:]) or None
+        result = self.model.transcribe(self.window,
+                                       language=self.language,
+                                       word_timestamps=True,
+                                       condition_on_previous_text=False,
+                                       initial_prompt=prompt,
+                                       temperature=0.0,
+                                       **self.transcribe_options)
+        self.passes += 1
+        self.pending = 0
+        words = []
+        for segment in result["segments"]:
+            for w in segment.get("words", []):
+                start = self.window_offset + w["start"]
+                end = self.window_offset + w["end"]
+                if end > self.committed_until + 0.05:
+                    words.append({"word": w["word"], "start": start, "end": end})
+        return words
+
+    def process(self):
+        words = self.transcribe_window()
+
+        # commit the longest prefix both passes agree on
+        agreed = 0
+        for old, new in zip(self.hypothesis, words):
+            if normalize_word(old["word"]) != normalize_word(new["word"]):
+                break
+            agreed += 1
+        if agreed == 0 and len(self.window) > self.max_window * WHISPER_RATE:
+            agreed = max(len(words) - 1, 0)  # window got too long without agreement, force it
+        self.commit(words[:agreed])
+        self.hypothesis = words[agreed:]
+
+        if words and not self.first_word_seen:
+            self.first_word_seen = True
+            self.first_word_latencies.append(time.time() - self.utterance_start)
+        self.on_partial(self.partial_text())
+
+    def commit(self, words):
+        if not words:
+            return
+        now = time.time()
+        for w in words:
+            self.commit_latencies.append(now - self.captured_at(w["end"]))
+        self.committed.extend(words)
+        self.committed_until = words[-1]["end"]
+
+        # drop the committed audio so the next pass only looks at what is still open
+        cut = int((self.committed_until - self.window_offset) * WHISPER_RATE)
+        if cut > 0:
+            self.window = self.window[cut:]
+            self.window_offset += cut / WHISPER_RATE
+        self.on_commit("".join(w["word"] for w in words))
+
+    def finish(self):
+        # end of utterance, everything left in the window is final
+        if self.pending > 0 or self.hypothesis:
+            if len(self.window) > 0:
+                words = self.transcribe_window()
+                if words and not self.first_word_seen:
+                    self.first_word_latencies.append(time.time() - self.utterance_start)
+                self.commit(words)
+        self.hypothesis = []
+        self.on_partial(None)
+        self.reset()
+
+    def partial_text(self):
+        return "".join(w["word"] for w in self.hypothesis)
+
+    def print_partial(self, text):
+        if text is None:
+            print()
+        else:
+            print(f"\r{self.line}\033[2m{text}\033[0m\033[K", end="", flush=True)
+
+    def print_commit(self, text):
+        self.line += text
+        print(f"\r{self.line}\033[K", end="", flush=True)
+
+    def stats(self):
+        return {
+            "passes": self.passes,
+            "time_to_first_word_p50": percentile(self.first_word_latencies, 50),
+            "time_to_first_word_p95": percentile(self.first_word_latencies, 95),
+            "commit_latency_p50": percentile(self.commit_latencies, 50),
+            "commit_latency_p95": percentile(self.commit_latencies, 95),
+        }
+
+    def run(self, audio_queue, print_stats=False):
+        # audio_queue carries float32 16 kHz chunks, None marks the end of an utterance and
+        # END_OF_SOURCE the end of the audio
+        while True:
+            item = audio_queue.get()
+            while True:
+                if item is END_OF_SOURCE:
+                    if self.pending > 0 or self.hypothesis:
+                        self.finish()
+                    return
+                if item is None:
+                    self.finish()
+                    if print_stats:
+                        print(format_stats(self.stats()))
+                else:
+                    self.add_audio(item)
+                try:
+                    item = audio_queue.get_nowait()
+                except queue.Empty:
+                    break
+            if self.ready():
+                try:
+                    self.process()
+                except Exception as e:
+                    print(f"Unexpected error processing audio stream: {e}")
+                    self.reset()
+
+
+def format_stats(stats):
+    def fmt(value):
+        return "-" if value is None else f"{value:.2f}s"
+    return (f"[stream] passes {stats['passes']}, "
+            f"first word p50 {fmt(stats['time_to_first_word_p50'])} p95 {fmt(stats['time_to_first_word_p95'])}, "
+            f"commit p50 {fmt(stats['commit_latency_p50'])} p95 {fmt(stats['commit_latency_p95'])}")
@@ -0,0 +1,187 @@
+import queue
+import time
+
+import numpy as np
+import torch
+import whisper
+
+import coalescer
+import dynamic_encoder
+import features
+import metrics
+from backends import get_backend
+from language import LanguageController
+
+MAX_SEGMENT = whisper.audio.N_SAMPLES     # 30 s, one mel window
+
+
+def is_fp16(model):
+    return model.device.type == "cuda"
+
+
+def warm_up(model):
+    # one short decode so kernels, allocator and tokenizer are set up before the first segment
+    mel = log_mel_batch(model, [np.zeros(whisper.audio.SAMPLE_RATE, dtype=np.float32)])
+    options = whisper.DecodingOptions(language="en", fp16=is_fp16(model), without_timestamps=True, sample_len=4)
+    backend = get_backend(model)
+    with torch.no_grad():
+        backend.decode(backend.encode(mel), options)
+
+
+def collect_batch(audio_queue, max_batch, max_wait=0.0):
+    # Blocks until there is at least one segment, then takes whatever else is already
+    # queued (waiting up to max_wait seconds for more) until the batch is full.
+    batch = [audio_queue.get()]
+    deadline = time.monotonic() + max_wait
+    while len(batch) < max_batch:
+        remaining = deadline - time.monotonic()
+        try:
+            if remaining > 0:
+                batch.append(audio_queue.get(timeout=remaining))
+            else:
+                batch.append(audio_queue.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+def log_mel_batch(model, segments, length=whisper.audio.N_SAMPLES, frames=None):
+    # frames: per segment, the log-mel frames computed during capture (features.py) or None
+    mels = []
+    for audio, computed in zip(segments, frames or [None] * len(segments)):
+        if computed is not None and computed.shape[1] == model.dims.n_mels:
+            mels.append(torch.from_numpy(features.log_mel(audio, computed, length, model.dims.n_mels)))
+        else:
+            mels.append(whisper.log_mel_spectrogram(whisper.pad_or_trim(audio, length), model.dims.n_mels))
+    return torch.stack(mels).to(model.device)
+
+
+def tokenizer(model):
+    return whisper.tokenizer.get_tokenizer(model.is_multilingual, num_languages=model.num_languages)
+
+
+def needs_fallback(result):
+    # same checks whisper.transcribe uses to retry a window at a higher temperature
+    return result.compression_ratio > 2.4 or result.avg_logprob < -1.0
+
+
+def is_silence(result):
+    return result.no_speech_prob > 0.6 and result.avg_logprob < -1.0
+
+
+def transcribe_segments(model, segments, language, fp16=False, coalesce=0, batch_size=4, dynamic=False, gate=None):
+    # transcribe_batch for Segment objects, fills in their timing fields. With coalesce (seconds),
+    # short segments share windows of up to that length, see transcribe_packed.
+    started = time.time()
+    audio = [segment.audio for segment in segments]
+    if coalesce:
+        texts = transcribe_packed(model, audio, language, fp16, coalesce, batch_size, dynamic, gate)
+    else:
+        texts = transcribe_batch(model, audio, language, fp16, dynamic=dynamic, gate=gate,
+                                 mel_frames=[segment.mel_frames for segment in segments])
+    done = time.time()
+    total = sum(segment.duration for segment in segments)
+    metrics.observe("model", done - started)
+    for segment in segments:
+        segment.dequeued_at = started
+        segment.done_at = done
+        segment.model_time = (done - started) * segment.duration / total if total > 0 else 0.0
+        if segment.queued_at is not None:
+            metrics.observe("queue_wait", started - segment.queued_at)
+    return texts
+
+
+def transcribe_packed(model, segments, language, fp16=False, max_window=24.0, batch_size=4, dynamic=False,
+                      gate=None):
+    # Like transcribe_batch, but consecutive segments are packed into windows of up to
+    # max_window seconds (coalescer.py), batch_size windows per encoder call. The text comes
+    # back one entry per segment, split up by whisper's timestamps.
+    packs = coalescer.pack(segments, whisper.audio.SAMPLE_RATE, max_window)
+    metrics.inc("packed_segments", len(segments) - len(packs))
+    texts = []
+    for i in range(0, len(packs), batch_size):
+        batch = packs[i:i + batch_size]
+        results = transcribe_batch(model, [p.audio for p in batch], language, fp16, True, dynamic, gate)
+        for p, pieces in zip(batch, results):
+            texts.extend(p.split(pieces) if p.count > 1 else [" ".join(text.strip() for _, _, text in pieces)])
+    return texts
+
+
+def transcribe_batch(model, segments, language, fp16=False, timestamps=False, dynamic=False, gate=None,
+                     mel_frames=None):
+    # Transcribes several segments with one encoder and one decoder call. Every segment is
+    # padded to a 30 s mel window, results come back in the order the segments went in.
+    # Segments longer than 30 s, and the few that would need whisper's temperature fallback,
+    # go through model.transcribe on their own. `language` is a code, "auto", or a
+    # LanguageController that keeps the detected language from one call to the next.
+    # With timestamps=True every segment gets a list of (start, end, text) instead of a text.
+    # dynamic=True runs the encoder on the clip length instead of 30 s (dynamic_encoder.py).
+    # gate, a NoSpeechGate, skips the decode for segments that are most likely not speech.
+    # mel_frames, per segment, are log-mel frames computed during capture (features.py).
+    controller = None
+    if isinstance(language, LanguageController):
+        controller, language = language, language.language
+    elif language == "auto":
+        language = None
+    texts = [None] * len(segments)
+    short = [i for i, audio in enumerate(segments) if len(audio) <= MAX_SEGMENT]
+
+    if short:
+        durations = [len(segments[i]) / whisper.audio.SAMPLE_RATE for i in short]
+        length = whisper.audio.N_SAMPLES
+        if dynamic:
+            length = dynamic_encoder.input_samples(max(len(segments[i]) for i in short))
+        with metrics.span("features", sync=True):
+            mel = log_mel_batch(model, [segments[i] for i in short], length,
+                                [mel_frames[i] for i in short] if mel_frames else None)
+        metrics.inc("encoder_windows", len(short))
+        with torch.no_grad():
+            with metrics.span("encoder", sync=True):
+                if length < whisper.audio.N_SAMPLES:
+                    audio_features = dynamic_encoder.embed_audio(model, mel)
+                else:
+                    audio_features = get_backend(model).encode(mel)
+            if gate is not None:
+                passed = gate.check(model, audio_features)
+                for i, duration, ok in zip(short, durations, passed):
+                    if not ok:
+                        texts[i] = [] if timestamps else ""
+                        gate.rejected(duration)
+                if not all(passed):
+                    audio_features = audio_features[[j for j, ok in enumerate(passed) if ok]]
+                    short = [i for i, ok in zip(short, passed) if ok]
+                    durations = [d for d, ok in zip(durations, passed) if ok]
+            results = []
+            if short:
+                detected = controller is not None and controller.needs_detection()
+                if detected:
+                    controller.detect(model, audio_features, durations)
+                if controller is not None:
+                    language = controller.language
+                options = whisper.DecodingOptions(language=language, fp16=fp16, without_timestamps=not timestamps)
+                started = time.perf_counter()
+                with metrics.span("decoder", sync=True):
+                    results = get_backend(model).decode(audio_features, options)
+                if gate is not None:
+                    gate.observe(time.perf_counter() - started, len(short))
+                if controller is not None:
+                    controller.observe(results, durations, detected)
+        for i, result in zip(short, results):
+            if is_silence(result):
+                texts[i] = [] if timestamps else ""
+                metrics.inc("silent_segments")
+            elif not needs_fallback(result):
+                texts[i] = coalescer.pieces_from_tokens(tokenizer(model), result.tokens) if timestamps else result.text
+
+    for i, text in enumerate(texts):
+        if text is None:
+            metrics.inc("fallbacks")
+            with metrics.span("fallback", sync=True):
+                # a bad decode in auto mode may be the wrong language, let whisper detect it for this one
+                retry_language = None if controller is not None and controller.redetect else language
+                result = model.transcribe(segments[i], language=retry_language, fp16=fp16)
+                if timestamps:
+                    texts[i] = [(s["start"], s["end"], s["text"]) for s in result["segments"]]
+                else:
+                    texts[i] = result["text"].strip()
+    return texts
@@ -0,0 +1,118 @@
+import numpy as np
+
+
+def frame_features(frames, rate):
+    # frames: (n, frame_length) int16 or float, one row per chunk. Everything is computed
+    # for the whole batch at once.
+    frames = np.asarray(frames)
+    if frames.dtype == np.int16:
+        mean_abs = np.abs(frames.astype(np.float32)).mean(axis=1)
+        frames = frames.astype(np.float32) / 32768.0
+    else:
+        frames = frames.astype(np.float32, copy=False)
+        mean_abs = np.abs(frames).mean(axis=1) * 32768.0
+
+    energy = 10.0 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (frames.shape[1] - 1)
+
+    window = np.hanning(frames.shape[1]).astype(np.float32)
+    power = np.abs(np.fft.rfft(frames * window, axis=1)) ** 2 + 1e-12
+    # only look at the speech band, hum and hiss would make everything look flat
+    freqs = np.fft.rfftfreq(frames.shape[1], 1.0 / rate)
+    band = power[:, (freqs >= 100) & (freqs <= 4000)]
+    flatness = np.exp(np.mean(np.log(band), axis=1)) / np.mean(band, axis=1)
+
+    return {"mean_abs": mean_abs, "energy": energy, "zcr": zcr, "flatness": flatness}
+
+
+class VAD:
+    # Base class for the speech detection backends. process() takes a batch of frames and
+    # returns one bool per frame. Hangover and minimum speech length are applied here so
+    # every backend gets them.
+
+    def __init__(self, rate, hangover=0, min_speech=1):
+        self.rate = rate
+        self.hangover = hangover        # frames to keep reporting speech after it stopped
+        self.min_speech = min_speech    # consecutive speech frames needed before speech starts
+        self.reset()
+
+    def reset(self):
+        self.speech_run = 0
+        self.hangover_left = 0
+
+    def raw_decisions(self, features):
+        raise NotImplementedError
+
+    def process(self, frames):
+        features = frame_features(frames, self.rate)
+        raw = self.raw_decisions(features)
+        decisions = np.zeros(len(raw), dtype=bool)
+        for i, speech in enumerate(raw):
+            if speech:
+                self.speech_run += 1
+                if self.speech_run >= self.min_speech:
+                    decisions[i] = True
+                    self.hangover_left = self.hangover
+            else:
+                self.speech_run = 0
+                if self.hangover_left > 0:
+                    self.hangover_left -= 1
+                    decisions[i] = True
+        return decisions
+
+
+class ThresholdVAD(VAD):
+    # The original detector: mean absolute amplitude of the chunk against one fixed number
+    # from measure_threshold().
+
+    def __init__(self, rate, threshold, hangover=0, min_speech=1):
+        self.threshold = threshold
+        super().__init__(rate, hangover, min_speech)
+
+    def raw_decisions(self, features):
+        return features["mean_abs"] >= self.threshold
+
+
+class AdaptiveVAD(VAD):
+    # Tracks the noise floor all the time (falls fast, rises slowly so speech does not pull
+    # it up but a louder room does), and calls a frame speech when it is clearly above the
+    # floor and does not look like noise (flat spectrum or very high zero-crossing rate).
+
+    def __init__(self, rate, frame_length, snr_db=9.0, max_flatness=0.35, max_zcr=0.35,
+                 rise_time=4.0, fall_time=0.1, hangover=3, min_speech=2, initial_floor_db=-60.0):
+        frame_time = frame_length / rate
+        self.initial_floor_db = initial_floor_db
+        self.snr_db = snr_db
+        self.max_flatness = max_flatness
+        self.max_zcr = max_zcr
+        self.rise = 1.0 - np.exp(-frame_time / rise_time)
+        self.fall = 1.0 - np.exp(-frame_time / fall_time)
+        super().__init__(rate, hangover, min_speech)
+
+    def reset(self):
+        super().reset()
+        # start from a quiet room rather than the first frame, which may already be speech
+        self.noise_floor = self.initial_floor_db
+
+    def raw_decisions(self, features):
+        energy = features["energy"]
+        floors = np.empty_like(energy)
+        floor = self.noise_floor
+        for i, e in enumerate(energy):
+            floors[i] = floor
+            floor += (self.fall if e < floor else self.rise) * (e - floor)
+        self.noise_floor = floor
+
+        loud = energy > floors + self.snr_db
+        voiced = (features["flatness"] < self.max_flatness) & (features["zcr"] < self.max_zcr)
+        return loud & voiced
+
+
+def make_vad(backend, rate, frame_length, threshold=None):
+    if backend == "threshold":
+        return ThresholdVAD(rate, threshold)
+    if backend == "adaptive":
+        return AdaptiveVAD(rate, frame_length)
+    raise ValueError(f"Unknown VAD backend: {backend}")
@@ -0,0 +1,49 @@
+import os
+import time
+
+import torch
+import whisper
+
+# Memory-mapped weight cache. whisper.load_model reads the whole checkpoint and converts its fp16
+# weights to fp32 on every start, into memory of the process's own. Here the loaded fp32 model
+# is saved once next to whisper's download, and later starts map that file instead: the weights
+# are the file's pages, read in as they are touched, and processes on one host that load the
+# same model share them through the page cache. The model is saved whole, so loading it runs
+# none of the modules' __init__ (building them on the meta device would still compute their
+# initial values there, and that imports torch._dynamo, 2 s of the start).
+
+
+def cache_root(download_root=None):
+    # where whisper downloads its checkpoints, the caches of every backend go next to them
+    return download_root or os.path.join(os.getenv("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")), "whisper")
+
+
+def cache_path(name, download_root=None):
+    root = cache_root(download_root)
+    torch_version = torch.__version__.split("+")[0]
+    checksum = whisper._MODELS[name].split("/")[-2][:8]     # a new checkpoint behind the same name gets a new cache
+    return os.path.join(root, f"{name}-{checksum}-fp32-whisper{whisper.__version__}-torch{torch_version}.pt")
+
+
+def load_model(name, device=None, download_root=None):
+    # whisper.load_model(name, device) through the cache; names whisper doesn't download
+    # (checkpoint paths) are loaded by whisper as they are
+    if name not in whisper._MODELS:
+        return whisper.load_model(name, device=device, download_root=download_root)
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    path = cache_path(name, download_root)
+    if os.path.exists(path):
+        try:
+            model = torch.load(path, map_location="cpu", weights_only=False, mmap=True)
+            return model.to(device)     # a copy on the GPU, on CPU the mapped weights stay
+        except Exception as e:
+            print(f"Ignoring the weight cache {path}: {e}")
+
+    started = time.time()
+    model = whisper.load_model(name, device="cpu", download_root=download_root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    part = f"{path}.{os.getpid()}.part"     # workers starting together each write their own
+    torch.save(model, part)
+    os.replace(part, path)
+    print(f"Cached the {name} weights in {path} ({time.time() - started:.1f} s), later starts map them")
+    return model.to(device)
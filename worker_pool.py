@@ -0,0 +1,163 @@
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+
+import metrics
+from segmenter import END_OF_SOURCE
+
+MAX_STREAMS = 16    # language controllers a worker keeps, one per stream, the least recently used goes
+
+
+def worker_main(worker_id, model_name, threads, workers, tasks, results):
+    # runs in its own process; thread limits have to be set before torch is imported
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["MKL_NUM_THREADS"] = str(threads)
+    import torch
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    import transcriber
+    from language import LanguageController
+    from model_loader import load_model
+
+    try:
+        model = load_model(model_name, device="cpu")
+        transcriber.warm_up(model)
+    except Exception as e:
+        results.put(("error", worker_id, None, f"{type(e).__name__}: {e}"))
+        return
+    results.put(("ready", worker_id, None, None))
+    controllers = {}
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        seq, audio, language, stream = task
+        started = time.time()
+        try:
+            controller = None
+            if language == "auto":
+                # One per stream (a file in batch mode), so a language locked in on one recording
+                # doesn't carry over into the next. A worker sees about one in `workers` segments
+                # of a stream, the seconds are scaled so they are still seconds of the stream.
+                controller = controllers.pop(stream, None) or LanguageController(redetect_every=60.0 / workers,
+                                                                                 half_life=120.0 / workers)
+                controllers[stream] = controller
+                if len(controllers) > MAX_STREAMS:
+                    del controllers[next(iter(controllers))]
+            text = transcriber.transcribe_batch(model, [audio], controller or language)[0]
+            results.put((seq, worker_id, text, None))
+        except Exception as e:
+            results.put((seq, worker_id, None, str(e)))
+        finally:
+            results.put(("busy", worker_id, time.time() - started, None))
+
+
+class TranscriptionPool:
+    # A pool of worker processes, each holding its own model. Segments are numbered as they
+    # are submitted, go to whichever worker is free (they all pull from one task queue) and
+    # the results are handed back in segment order.
+
+    def __init__(self, workers, model_name, threads_per_worker=None, launched=None):
+        self.workers = workers
+        self.model_name = model_name
+        self.threads = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+        self.launched = launched or time.time()
+        context = mp.get_context("spawn")
+        self.tasks = context.Queue(maxsize=workers * 2)
+        self.results = context.Queue()
+        self.processes = [context.Process(target=worker_main,
+                                          args=(i, model_name, self.threads, workers, self.tasks, self.results),
+                                          daemon=True)
+                          for i in range(workers)]
+        for process in self.processes:
+            process.start()
+
+        self.next_seq = 0
+        self.next_out = 0
+        self.done = {}
+        self.fed_all = False        # feed() got END_OF_SOURCE, next_seq is the final count
+        self.ready_workers = 0
+        self.busy_time = [0.0] * workers
+        self.time_to_ready = None
+        self.ready_at = None
+
+    def submit(self, audio, language, stream=None):
+        # stream: segments with the same key share the auto-detected language (see worker_main)
+        seq = self.next_seq
+        self.next_seq += 1
+        self.tasks.put((seq, audio, language, stream))  # blocks while every worker already has work lined up
+        return seq
+
+    def feed(self, audio_queue, language):
+        # dispatcher thread: audio_queue -> workers
+        def run():
+            while True:
+                segment = audio_queue.get()
+                if segment is END_OF_SOURCE:
+                    self.results.put(("end", None, None, None))     # results_in_order stops after the last one
+                    return
+                if segment.queued_at is not None:
+                    metrics.observe("queue_wait", time.time() - segment.queued_at)
+                self.submit(segment.audio, language)
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def utilization(self, worker_id):
+        # share of the time since the pool was ready that this worker spent transcribing
+        if self.ready_at is None:
+            return 0.0
+        return self.busy_time[worker_id] / max(time.time() - self.ready_at, 1e-9)
+
+    def wait_ready(self):
+        while self.ready_workers < self.workers:
+            self.handle(self.next_message())
+        return self.time_to_ready
+
+    def next_message(self, poll=1.0):
+        # results.get(), but a worker that died (crash, killed for memory) raises instead of hanging
+        while True:
+            try:
+                return self.results.get(timeout=poll)
+            except queue.Empty:
+                for i, process in enumerate(self.processes):
+                    if not process.is_alive():
+                        raise RuntimeError(f"Worker {i} exited with code {process.exitcode}")
+
+    def handle(self, message):
+        seq, worker_id, value, error = message
+        if seq == "error":
+            raise RuntimeError(f"Worker {worker_id} could not load {self.model_name}: {error}")
+        if seq == "ready":
+            self.ready_workers += 1
+            if self.ready_workers == self.workers:
+                self.time_to_ready = time.time() - self.launched
+                self.ready_at = time.time()
+        elif seq == "end":
+            self.fed_all = True
+        elif seq == "busy":
+            self.busy_time[worker_id] += value
+            metrics.observe("model", value)
+        else:
+            self.done[seq] = (value, error)
+
+    def results_in_order(self):
+        # yields (seq, text, error) in the order the segments were submitted, ends after the
+        # last segment when the feed() source ended
+        while True:
+            while self.next_out in self.done:
+                text, error = self.done.pop(self.next_out)
+                yield self.next_out, text, error
+                self.next_out += 1
+            if self.fed_all and self.next_out == self.next_seq:
+                return
+            self.handle(self.next_message())
+
+    def close(self):
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=5)